@@ -0,0 +1,388 @@
+"""Durable per-chat activity storage backed by SQLite with write-behind batching."""
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+from leaderboard import Leaderboard
+from rolling import RING_DAYS, DayRing
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    last_active REAL,
+    username TEXT,
+    full_name TEXT,
+    PRIMARY KEY (chat_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS daily_counts (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, day, user_id)
+);
+-- Pruning drops whole days, which the primary key can't find without a scan
+CREATE INDEX IF NOT EXISTS daily_counts_day ON daily_counts (day);
+-- Leaderboard digests already sent, by kind and the first day of their window
+CREATE TABLE IF NOT EXISTS digests_posted (
+    kind TEXT NOT NULL,
+    first_day INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (kind, first_day, chat_id)
+);
+"""
+
+UPSERT_MEMBER = """
+INSERT INTO members (chat_id, user_id, messages, last_active, username, full_name)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (chat_id, user_id) DO UPDATE SET
+    messages = messages + excluded.messages,
+    last_active = excluded.last_active,
+    username = excluded.username,
+    full_name = excluded.full_name
+"""
+
+# Same as UPSERT_MEMBER for members whose profile hasn't changed since the last write
+UPSERT_COUNT = """
+INSERT INTO members (chat_id, user_id, messages, last_active)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (chat_id, user_id) DO UPDATE SET
+    messages = messages + excluded.messages,
+    last_active = excluded.last_active
+"""
+
+# The top members of each chat picked by wanted() over a range of days, with the profile to show them by
+WINDOW_TOTALS = """
+SELECT r.chat_id, r.total, r.user_id, m.full_name, m.username
+FROM (
+    SELECT chat_id, user_id, total,
+           ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY total DESC, user_id) AS rank
+    FROM (
+        SELECT chat_id, user_id, SUM(messages) AS total
+        FROM daily_counts
+        WHERE day BETWEEN ? AND ? AND wanted(chat_id)
+        GROUP BY chat_id, user_id
+    )
+) r JOIN members m ON m.chat_id = r.chat_id AND m.user_id = r.user_id
+WHERE r.rank <= ?
+ORDER BY r.chat_id, r.rank
+"""
+
+UPSERT_DAY = """
+INSERT INTO daily_counts (chat_id, user_id, day, messages)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (chat_id, day, user_id) DO UPDATE SET
+    messages = messages + excluded.messages
+"""
+
+WEEK_DAYS = 7
+MONTH_DAYS = 30
+
+# Boards for other windows (/top 3d) kept up to date per chat, most recently asked for first
+MAX_CUSTOM_BOARDS = 2
+
+
+class Member(DayRing):
+    """One member's counters: lifetime messages, last activity, profile and daily ring.
+
+    A member is its own ``DayRing`` with a few more slots, so a record is a
+    single slotted object plus its bucket array instead of a dict, a ring
+    and a datetime. ``last_active`` is a Unix timestamp.
+    """
+
+    __slots__ = ('messages', 'last_active', 'username', 'full_name')
+
+    def __init__(self, messages=0, last_active=None, username=None, full_name=None):
+        super().__init__()
+        self.messages = messages
+        self.last_active = last_active
+        self.username = username
+        self.full_name = full_name
+
+
+class ChatActivity:
+    """In-memory view of a single chat's activity.
+
+    Every member is a ``Member``, which carries its own ring of daily counts.
+    A ``Leaderboard`` of the top ``board_size`` members is kept for the 7- and
+    30-day windows and for the ``MAX_CUSTOM_BOARDS`` other windows asked for
+    most recently. Within a day the window totals only grow, so a board is
+    updated in place as messages arrive. Once the day changes a board is
+    stale: messages stop updating it and it is rebuilt from the members the
+    next time it is asked for, so no message pays for the rebuild.
+    """
+
+    def __init__(self, today, board_size=10):
+        self.members = {}
+        self.today = today
+        self.board_size = board_size
+        # days -> (day the board is current for, board)
+        self.boards = {WEEK_DAYS: (today, Leaderboard(board_size)), MONTH_DAYS: (today, Leaderboard(board_size))}
+        self._custom = []
+
+    @property
+    def weekly_top(self):
+        return self.board(WEEK_DAYS)
+
+    @property
+    def monthly_top(self):
+        return self.board(MONTH_DAYS)
+
+    def total(self, user_id, days):
+        """Messages sent by ``user_id`` in the last ``days`` days."""
+        member = self.members.get(user_id)
+        return member.total(days, self.today) if member else 0
+
+    def board(self, days):
+        """Return the leaderboard for a ``days``-long window, building it if it is missing or stale."""
+        if days not in (WEEK_DAYS, MONTH_DAYS):
+            if days in self._custom:
+                self._custom.remove(days)
+            self._custom.append(days)
+            if len(self._custom) > MAX_CUSTOM_BOARDS:
+                self.boards.pop(self._custom.pop(0), None)
+        current = self.boards.get(days)
+        if current is not None and current[0] == self.today:
+            return current[1]
+        board = self._build(days)
+        self.boards[days] = (self.today, board)
+        return board
+
+    def current_boards(self):
+        """``(days, board)`` of the boards that are up to date for today."""
+        return [(days, board) for days, (day, board) in self.boards.items() if day == self.today]
+
+    def roll(self, today):
+        """Move to a new day; the boards built for the old one go stale."""
+        self.today = today
+
+    def _build(self, days):
+        counts = {}
+        for user_id, member in self.members.items():
+            count = member.total(days, self.today)
+            if count:
+                counts[user_id] = count
+        return Leaderboard.from_counts(counts, self.board_size)
+
+
+class ActivityStore:
+    """Per-chat activity counters that are persisted in batches.
+
+    ``record`` only updates the in-memory view and appends an increment to a
+    pending buffer. A background thread commits the buffer in one transaction
+    every ``flush_interval`` seconds, or sooner once ``flush_size`` distinct
+    members are waiting.
+    """
+
+    def __init__(self, path='activity.db', flush_interval=1.0, flush_size=500, board_size=10):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.board_size = board_size
+        self._chats = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._conn = None
+        self._thread = None
+        self._pruned = None
+
+    def open(self, path=None):
+        """Open the database and start the background flusher."""
+        if path:
+            self.path = path
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        # Exports and digests read through connections of their own; wait for them instead of failing
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.executescript(SCHEMA)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='activity-flusher', daemon=True)
+        self._thread.start()
+        logger.info(f"Activity store opened at {self.path}")
+
+    def close(self):
+        """Stop the flusher, write out anything still pending and close the database."""
+        if self._conn is None:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+            self._conn = None
+
+    def chat(self, chat_id, now=None):
+        """Return the in-memory activity of a chat, loading it on first use."""
+        today = (now or datetime.now()).date().toordinal()
+        with self._lock:
+            stats = self._chats.get(chat_id)
+            if stats is None:
+                stats = self._load(chat_id, today)
+                self._chats[chat_id] = stats
+            stats.roll(today)
+            return stats
+
+    def record(self, chat_id, user_id, username, full_name, now=None):
+        """Count one message from ``user_id`` in ``chat_id``."""
+        now = now or datetime.now()
+        stats = self.chat(chat_id, now)
+        today = stats.today
+        timestamp = now.timestamp()
+        with self._lock:
+            member = stats.members.get(user_id)
+            if member is None:
+                member = stats.members[user_id] = Member()
+            member.messages += 1
+            member.last_active = timestamp
+            member.add(today)
+            # Profiles rarely change; only then are they stored and the boards' snapshots retaken
+            profile_changed = member.username != username or member.full_name != full_name
+            if profile_changed:
+                member.username = username
+                member.full_name = full_name
+            for days, board in stats.current_boards():
+                if profile_changed:
+                    board.touch(user_id)
+                board.update(user_id, member.total(days, today))
+
+            key = (chat_id, user_id, today)
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = [0, None, None]
+            pending[0] += 1
+            pending[1] = timestamp
+            if profile_changed:
+                pending[2] = (username, full_name)
+            backlog = len(self._pending)
+
+        if backlog >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Commit all pending increments in a single transaction.
+
+        If the transaction fails the increments go back into the pending
+        buffer, to be written with the next flush.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch or self._conn is None:
+            return 0
+
+        members = []
+        counts = []
+        days = []
+        for (chat_id, user_id, day), (count, last_active, profile) in batch.items():
+            if profile is None:
+                counts.append((chat_id, user_id, count, last_active))
+            else:
+                members.append((chat_id, user_id, count, last_active) + profile)
+            days.append((chat_id, user_id, day, count))
+
+        # Buckets that have left every ring are never read again; more only do so as the day moves on
+        expired = max(day for _, _, day, _ in days) - RING_DAYS
+        prune = self._pruned is None or expired > self._pruned
+        try:
+            with self._db_lock:
+                with self._conn:
+                    self._conn.executemany(UPSERT_MEMBER, members)
+                    self._conn.executemany(UPSERT_COUNT, counts)
+                    self._conn.executemany(UPSERT_DAY, days)
+                    if prune:
+                        self._conn.execute('DELETE FROM daily_counts WHERE day <= ?', (expired,))
+                if prune:
+                    self._pruned = expired
+        except Exception:
+            self._restore(batch)
+            raise
+        return len(batch)
+
+    def _restore(self, batch):
+        # Merge an unwritten batch back under anything recorded since it was taken
+        with self._lock:
+            for key, (count, last_active, profile) in batch.items():
+                pending = self._pending.get(key)
+                if pending is None:
+                    self._pending[key] = [count, last_active, profile]
+                    continue
+                pending[0] += count
+                if pending[2] is None:
+                    pending[2] = profile
+
+    def window_totals(self, first_day, last_day, size, chats=None):
+        """Top ``size`` ``(count, user_id, full_name, username)`` rows per chat over a closed range of days.
+
+        Only chats for which ``chats(chat_id)`` is true are ranked, if given;
+        the ranking and the filter both run in SQLite, so just the rows asked
+        for are loaded. Pending counts are flushed first. The query runs on a
+        connection of its own, so it neither touches the in-memory counters
+        nor holds up flushes.
+        """
+        self.flush()
+        ranked = {}
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.create_function('wanted', 1, chats or (lambda chat_id: True), deterministic=True)
+            for chat_id, count, user_id, full_name, username in conn.execute(
+                    WINDOW_TOTALS, (first_day, last_day, size)):
+                ranked.setdefault(chat_id, []).append((count, user_id, full_name, username))
+        finally:
+            conn.close()
+        return ranked
+
+    def digests_posted(self, kind, first_day):
+        """Chat ids that have had the ``kind`` digest of the window starting on ``first_day``."""
+        with self._db_lock:
+            rows = self._conn.execute('SELECT chat_id FROM digests_posted WHERE kind = ? AND first_day = ?',
+                                      (kind, first_day)).fetchall()
+        return {chat_id for chat_id, in rows}
+
+    def mark_digest_posted(self, chat_id, kind, first_day):
+        """Record that ``chat_id`` has had the ``kind`` digest of the window starting on ``first_day``."""
+        with self._db_lock:
+            with self._conn:
+                self._conn.execute('INSERT OR IGNORE INTO digests_posted VALUES (?, ?, ?)',
+                                   (kind, first_day, chat_id))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush activity: {e}")
+
+    def _load(self, chat_id, today):
+        stats = ChatActivity(today, self.board_size)
+        if self._conn is None:
+            return stats
+        with self._db_lock:
+            rows = self._conn.execute(
+                'SELECT user_id, messages, last_active, username, full_name FROM members WHERE chat_id = ?',
+                (chat_id,)
+            ).fetchall()
+            daily = self._conn.execute(
+                'SELECT user_id, day, messages FROM daily_counts WHERE chat_id = ? AND day > ? ORDER BY day',
+                (chat_id, today - RING_DAYS)
+            ).fetchall()
+        for user_id, messages, last_active, username, full_name in rows:
+            stats.members[user_id] = Member(messages, last_active, username, full_name)
+        for user_id, day, messages in daily:
+            member = stats.members.get(user_id)
+            if member is not None:
+                member.add(day, messages)
+        # Built from the loaded members when first asked for
+        stats.boards = {days: (None, board) for days, (_, board) in stats.boards.items()}
+        return stats
@@ -0,0 +1,208 @@
+"""Drive the real bot (Updater, dispatcher, handlers, outbox) against the local fake Bot API.
+
+Synthetic updates are served to the bot's long polling by tools/fake_bot_api.py,
+one scenario after another: a message flood into track_activity, a mass join
+into new_member, and storms of /topweekly and /joke. For each scenario the
+throughput, p50/p99 handler latency and outbound Bot API calls are reported.
+
+The outbox rate limits and the flood limits are lifted by default (the fake
+API enforces none, and every synthetic user floods), so the numbers reflect
+the bot's own work; set OUTBOX_* and FLOOD_* to measure with the production
+limits. BENCH_OUTPUT=path also writes the results as JSON.
+
+    python benchmarks/dispatch_bench.py
+"""
+import itertools
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+MESSAGES = int(os.getenv('BENCH_MESSAGES', '20000'))
+JOINS = int(os.getenv('BENCH_JOINS', '2000'))
+COMMANDS = int(os.getenv('BENCH_COMMANDS', '2000'))
+CHATS = int(os.getenv('BENCH_CHATS', '50'))
+USERS = int(os.getenv('BENCH_USERS', '500'))
+LATENCY = float(os.getenv('BENCH_LATENCY', '0.005'))
+SETTLE = float(os.getenv('BENCH_SETTLE_SECONDS', '2'))
+TIMEOUT = float(os.getenv('BENCH_TIMEOUT_SECONDS', '120'))
+
+update_ids = itertools.count(1)
+message_ids = itertools.count(1)
+
+
+def _message(chat_id, user_id, **fields):
+    message = {
+        'message_id': next(message_ids), 'date': int(time.time()),
+        'chat': {'id': -chat_id, 'type': 'supergroup', 'title': f"Chat {chat_id}"},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"},
+    }
+    message.update(fields)
+    return {'update_id': next(update_ids), 'message': message}
+
+
+def text_message(index):
+    return _message(index % CHATS + 1, index % USERS + 1, text=f"message {index}")
+
+
+def command(name):
+    def build(index):
+        return _message(index % CHATS + 1, index % USERS + 1, text=f"/{name}",
+                        entities=[{'type': 'bot_command', 'offset': 0, 'length': len(name) + 1}])
+    return build
+
+
+def join(index):
+    user_id = 1_000_000 + index
+    member = {'id': user_id, 'is_bot': False, 'first_name': f"New{user_id}"}
+    return _message(index % CHATS + 1, user_id, new_chat_members=[member])
+
+
+SCENARIOS = [
+    ('message flood', 'track_activity', text_message, MESSAGES),
+    ('mass join', 'new_member', join, JOINS),
+    ('/topweekly storm', 'top_weekly', command('topweekly'), COMMANDS),
+    ('/joke storm', 'joke', command('joke'), COMMANDS),
+]
+
+
+class Recorder:
+    """Stand-in for ``metrics.timed`` that keeps every handler latency sample."""
+
+    def __init__(self, timed):
+        self.timed = timed
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def __call__(self, name, callback):
+        samples = self.samples[name]
+
+        def record(update, context):
+            start = time.perf_counter()
+            try:
+                return callback(update, context)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    samples.append(elapsed)
+        return self.timed(name, record)
+
+    def count(self, name):
+        with self.lock:
+            return len(self.samples[name])
+
+    def reset(self):
+        with self.lock:
+            for samples in self.samples.values():
+                samples.clear()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[int(fraction * (len(ordered) - 1))] if ordered else 0.0
+
+
+def wait_until(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def run_scenario(api, bot, recorder, name, handler, build, count):
+    recorder.reset()
+    api.reset()
+    before = bot.outbox.stats()
+
+    start = time.perf_counter()
+    for index in range(count):
+        api.push_update(build(index))
+    done = wait_until(lambda: recorder.count(handler) >= count, TIMEOUT)
+    elapsed = time.perf_counter() - start
+
+    # Let batched welcomes fire and the outbox drain before counting sends
+    time.sleep(SETTLE)
+    wait_until(lambda: bot.outbox.stats()['depth'] == 0, TIMEOUT)
+    after = bot.outbox.stats()
+
+    samples = recorder.samples[handler]
+    return {
+        'scenario': name,
+        'updates': count,
+        'handled': len(samples),
+        'complete': done,
+        'seconds': elapsed,
+        'updates_per_second': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'api_calls': {method: n for method, n in sorted(api.calls.items()) if method != 'getUpdates'},
+        'outbox': {key: after[key] - before[key] for key in ('sent', 'failed', 'dropped', 'merged')},
+    }
+
+
+def report(results):
+    print(f"{'scenario':<18} {'updates':>8} {'upd/s':>9} {'p50 ms':>8} {'p99 ms':>8}  outbound")
+    for result in results:
+        calls = ', '.join(f"{method}={n}" for method, n in result['api_calls'].items()) or '-'
+        flag = '' if result['complete'] else '  (timed out)'
+        print(f"{result['scenario']:<18} {result['handled']:>8} {result['updates_per_second']:>9.0f} "
+              f"{result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f}  {calls}{flag}")
+        print(f"{'':<18} outbox: {result['outbox']}")
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='dispatch-bench-')
+    api = FakeBotAPI(latency=LATENCY).start()
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123:bench',
+        'TELEGRAM_BASE_URL': api.base_url,
+        'ACTIVITY_DB': os.path.join(workdir, 'activity.db'),
+        'METRICS_PORT': '',
+        'BOT_MODE': 'polling',
+    })
+    for key, value in {'LOG_LEVEL': 'WARNING', 'WELCOME_WINDOW_SECONDS': '0.5',
+                       'OUTBOX_GLOBAL_RATE': '100000', 'OUTBOX_CHAT_RATE': '100000',
+                       'OUTBOX_CHAT_BURST': '100000', 'OUTBOX_MAX_QUEUE': '100000',
+                       'FLOOD_USER_LIMIT': '0', 'FLOOD_CHAT_COMMANDS': '0'}.items():
+        os.environ.setdefault(key, value)
+    os.chdir(workdir)
+
+    import bot
+    recorder = Recorder(bot.timed)
+    bot.timed = recorder
+    results = []
+
+    def drive():
+        try:
+            # Wait for polling to start before pushing the first scenario
+            wait_until(lambda: bot.profiler.ready_at is not None, TIMEOUT)
+            for scenario in SCENARIOS:
+                results.append(run_scenario(api, bot, recorder, *scenario))
+        finally:
+            os.kill(os.getpid(), signal.SIGINT)
+
+    threading.Thread(target=drive, name='bench-driver', daemon=True).start()
+    bot.main()
+    api.stop()
+
+    report(results)
+    output = os.getenv('BENCH_OUTPUT')
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
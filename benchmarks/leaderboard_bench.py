@@ -0,0 +1,73 @@
+"""Compare /topweekly latency: full sort per command vs. the incremental leaderboard."""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from activity_store import ActivityStore  # noqa: E402
+from leaderboard import SnapshotStore, format_rows, profile_rows  # noqa: E402
+
+MEMBERS = int(os.getenv('BENCH_MEMBERS', '100000'))
+MESSAGES = int(os.getenv('BENCH_MESSAGES', '500000'))
+COMMANDS = int(os.getenv('BENCH_COMMANDS', '200'))
+TITLE = "Top Active Members (Last 7 Days)"
+
+
+def sorted_command(stats, weekly):
+    """The original implementation: sort every member on each call."""
+    entries = [(count, user_id) for user_id, count in
+               sorted(weekly.items(), key=lambda x: x[1], reverse=True)[:10]]
+    return format_rows(TITLE, profile_rows(entries, stats.members))
+
+
+def indexed_command(snapshots, chat_id, stats):
+    """What the bot does now: a snapshot of the live board, reused while the board is unchanged."""
+    return snapshots.take(chat_id, 7, stats.weekly_top, stats.members, TITLE)[1].page(0)
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed / count * 1e6:>12.1f} us/op")
+    return elapsed
+
+
+def main():
+    random.seed(42)
+    store = ActivityStore()  # never opened: purely in-memory
+    chat_id = -100
+
+    # Skewed traffic: a few members talk a lot, most only occasionally.
+    users = [int(random.paretovariate(1.2) * 1000) % MEMBERS for _ in range(MESSAGES)]
+    users.extend(range(MEMBERS))
+    random.shuffle(users)
+
+    start = time.perf_counter()
+    for user_id in users:
+        store.record(chat_id, user_id, f"user_{user_id}", f"User {user_id}")
+    elapsed = time.perf_counter() - start
+    stats = store.chat(chat_id)
+    weekly = {user_id: stats.total(user_id, 7) for user_id in stats.members}
+    print(f"members tracked: {len(weekly)}, messages: {len(users)}")
+    print(f"{'track_activity (record)':<36} {elapsed / len(users) * 1e6:>12.1f} us/op")
+
+    # Members with equal counts may be ranked in either order, so only the counts have to match
+    top = sorted(weekly.values(), reverse=True)[:10]
+    assert [count for count, _ in stats.weekly_top.entries()] == top
+
+    snapshots = SnapshotStore()
+    timed('topweekly, sorted() per call', COMMANDS, lambda: sorted_command(stats, weekly))
+    timed('topweekly, leaderboard (cached)', COMMANDS, lambda: indexed_command(snapshots, chat_id, stats))
+
+    def churn():
+        store.record(chat_id, stats.weekly_top.entries()[0][1], 'top', 'Top')
+        indexed_command(snapshots, chat_id, stats)
+    timed('topweekly, leaderboard (invalidated)', COMMANDS, churn)
+
+
+if __name__ == '__main__':
+    main()
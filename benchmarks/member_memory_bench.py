@@ -0,0 +1,65 @@
+"""Per-member memory footprint of the activity store's member records.
+
+Builds BENCH_MEMBERS members (1M by default) as the old dict records (a dict
+holding a datetime and a separate DayRing) and as ``Member`` objects, and
+reports the bytes each costs as measured by tracemalloc. Profile strings
+are shared between both runs so only the record itself is counted.
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from activity_store import Member  # noqa: E402
+from rolling import DayRing  # noqa: E402
+
+MEMBERS = int(os.getenv('BENCH_MEMBERS', '1000000'))
+
+
+def dict_record(username, full_name, now, today):
+    ring = DayRing()
+    ring.add(today)
+    return {'messages': 1, 'last_active': now, 'username': username, 'full_name': full_name, 'days': ring}
+
+
+def slotted_record(username, full_name, now, today):
+    member = Member(1, now.timestamp(), username, full_name)
+    member.add(today)
+    return member
+
+
+def measure(build, profiles, now, today):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    members = {}
+    for user_id, (username, full_name) in enumerate(profiles):
+        members[user_id] = build(username, full_name, datetime.fromtimestamp(now), today)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del members
+    return size, elapsed
+
+
+def main():
+    now = time.time()
+    today = datetime.fromtimestamp(now).date().toordinal()
+    profiles = [(f"user{user_id}", f"User {user_id}") for user_id in range(MEMBERS)]
+
+    print(f"{MEMBERS} members")
+    results = {}
+    for name, build in (('dict + DayRing', dict_record), ('Member (slots)', slotted_record)):
+        size, elapsed = measure(build, profiles, now, today)
+        results[name] = size
+        print(f"{name:<16} {size / 2 ** 20:8.1f} MiB  {size / MEMBERS:6.0f} B/member  built in {elapsed:.2f}s")
+    before, after = results.values()
+    print(f"saved {(before - after) / MEMBERS:.0f} B/member ({1 - after / before:.0%})")
+
+
+if __name__ == '__main__':
+    main()
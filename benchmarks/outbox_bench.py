@@ -0,0 +1,55 @@
+"""Drive the outbox against the local fake Bot API during a simulated raid."""
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from telegram import Bot  # noqa: E402
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from outbound import Outbox, PRIORITY_FUN, PRIORITY_STICKER, PRIORITY_WELCOME  # noqa: E402
+
+CHATS = int(os.getenv('BENCH_CHATS', '20'))
+WELCOMES = int(os.getenv('BENCH_WELCOMES', '5'))
+FUN = int(os.getenv('BENCH_FUN', '10'))
+LATENCY = float(os.getenv('BENCH_LATENCY', '0.02'))
+
+
+def main():
+    api = FakeBotAPI(latency=LATENCY, chat_interval=0.9).start()
+    bot = Bot('123:fake', base_url=api.base_url)
+    outbox = Outbox(global_rate=30, chat_rate=1, chat_burst=1, max_queue=CHATS * 10)
+    outbox.start(bot)
+
+    start = time.monotonic()
+    futures = []
+    for chat_id in range(1, CHATS + 1):
+        for idx in range(FUN):
+            futures.append(outbox.send_message(chat_id, f"joke {idx}", PRIORITY_FUN))
+        for idx in range(WELCOMES):
+            futures.append(outbox.send_message(chat_id, f"welcome {idx}", PRIORITY_WELCOME))
+            outbox.send_sticker(chat_id, 'sticker', PRIORITY_STICKER, merge_key='sticker')
+
+    deadline = time.monotonic() + 60
+    while outbox.stats()['depth'] and time.monotonic() < deadline:
+        time.sleep(0.2)
+    elapsed = time.monotonic() - start
+    outbox.stop()
+    api.stop()
+
+    stats = outbox.stats()
+    print(f"elapsed: {elapsed:.2f}s, API calls: {dict(api.calls)}, 429s: {api.flood_errors}")
+    for key in ('sent', 'failed', 'dropped', 'merged', 'retried'):
+        print(f"{key:>8}: {stats[key]}")
+    print(f"wait avg {stats['wait_avg'] * 1000:.0f} ms, max {stats['wait_max'] * 1000:.0f} ms")
+    first_welcome = min(t for t, method, _, data in api.sent if data.get('text', '').startswith('welcome'))
+    first_joke = min((t for t, method, _, data in api.sent if data.get('text', '').startswith('joke')),
+                     default=None)
+    print(f"first welcome sent before first joke: {first_joke is None or first_welcome < first_joke}")
+
+
+if __name__ == '__main__':
+    main()
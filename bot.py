@@ -1,48 +1,96 @@
-# Import imghdr compatibility first
-import imghdr_compat  # This must be imported before any telegram imports
+# Time every startup step, starting before anything else is imported
+from startup import profiler
+
+with profiler.phase('import imghdr_compat'):
+    # Import imghdr compatibility first
+    import imghdr_compat  # This must be imported before any telegram imports
 
 import os
+import signal
+import threading
+import atexit
 import logging
 import random
 import json
 import asyncio
 import sys
 import time
-from telegram.ext import PicklePersistence
 from datetime import datetime, timedelta
-from collections import defaultdict
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, ParseMode, StickerSet
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler
-from telegram.utils.helpers import mention_html
-from dotenv import load_dotenv
-
-# For Python 3.13+ compatibility
-if sys.version_info >= (3, 13):
-    import imghdr
-    if not hasattr(imghdr, 'test_jpeg'):
-        def test_jpeg(h, f):
-            """Test for JPEG data in Python 3.13+"""
-            if h.startswith(b'\xff\xd8'):
-                return 'jpeg'
-        imghdr.tests.append(('jpeg', test_jpeg))
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+
+with profiler.phase('import telegram'):
+    from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, ParseMode, StickerSet
+    from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler
+    from telegram.ext import TypeHandler, Dispatcher, JobQueue, DispatcherHandlerStop
+    from telegram.utils.helpers import mention_html
+    from apscheduler.executors.pool import ThreadPoolExecutor as JobExecutor
+
+with profiler.phase('import bot modules'):
+    from dotenv import load_dotenv
+    from activity_store import ActivityStore
+    from leaderboard import SnapshotStore
+    from rolling import MAX_WINDOW_DAYS
+    from outbound import Outbox, TokenBucket, PRIORITY_WELCOME, PRIORITY_STICKER
+    from welcome import JoinCoalescer
+    from caches import MemberCountCache, ProfilePhotoCache
+    from stickers import StickerCatalogue
+    from rotation import Rotations
+    from corpus import Corpus
+    from logsetup import setup_logging, parse_events
+    from metrics import registry, timed, InstrumentedRequest, MetricsServer
+    from traffic import UpdateRecorder
+    from sharding import ShardRouter, shard_of, shard_path
+    from journal import JournalPersistence
+    from dedup import SeenUpdates
+    from floodgate import SlidingWindow
+    from digests import Digests
+    from export import Exporter
+
+# Load environment variables
+with profiler.phase('load .env'):
+    if os.path.exists('.env'):
+        load_dotenv('.env')
+
+# Log records are written as JSON lines by a background thread; noisy events are sampled
+log_listener = setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    fmt=os.getenv('LOG_FORMAT', 'json'),
+    events=parse_events(os.environ['LOG_EVENTS']) if os.getenv('LOG_EVENTS') else None
 )
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv('.env')
+# Per-chat activity, persisted to SQLite in batches by a background flusher
+activity = ActivityStore(
+    path=os.getenv('ACTIVITY_DB', 'activity.db'),
+    flush_interval=int(os.getenv('ACTIVITY_FLUSH_MS', '1000')) / 1000,
+    flush_size=int(os.getenv('ACTIVITY_FLUSH_SIZE', '500')),
+    board_size=int(os.getenv('LEADERBOARD_DEPTH', '50'))
+)
+
+# Leaderboard rankings as of each command, paged through with inline buttons until they expire
+snapshots = SnapshotStore(
+    ttl=float(os.getenv('LEADERBOARD_SNAPSHOT_TTL', '600')),
+    maxsize=int(os.getenv('LEADERBOARD_SNAPSHOTS', '1000'))
+)
+
+# Every message the bot sends goes through this rate-limited priority queue
+outbox = Outbox(
+    global_rate=float(os.getenv('OUTBOX_GLOBAL_RATE', '30')),
+    chat_rate=float(os.getenv('OUTBOX_CHAT_RATE', str(20 / 60))),
+    chat_burst=int(os.getenv('OUTBOX_CHAT_BURST', '5')),
+    max_queue=int(os.getenv('OUTBOX_MAX_QUEUE', '1000'))
+)
 
-# In-memory storage for active members (in a real app, use a database)
-active_members = defaultdict(lambda: {'messages': 0, 'last_active': None, 'username': None, 'full_name': None})
-weekly_stats = defaultdict(int)
-monthly_stats = defaultdict(int)
-last_weekly_reset = datetime.now()
-last_monthly_reset = datetime.now()
+# Emoji → sticker file_id index, fetched from these sets once and cached on disk
+stickers = StickerCatalogue(
+    os.getenv('STICKER_SETS', '').split(','),
+    path=os.getenv('STICKER_CATALOGUE', 'stickers.json'),
+    refresh_interval=float(os.getenv('STICKER_REFRESH_SECONDS', '86400'))
+)
 
-# List of emoji stickers that can be sent directly
+# Emojis to pick stickers for
 EMOJI_STICKERS = [
     '😊',  # Smiling face with smiling eyes
     '🎉',  # Party popper
@@ -56,347 +104,113 @@ EMOJI_STICKERS = [
     '🎯'   # Direct hit
 ]
 
-# Track which jokes and quotes have been used
-used_joke_indices = set()
-used_quote_indices = set()
-
-# Store recently used jokes and quotes to prevent repetition
-recent_jokes = []
-recent_quotes = []
-
-def get_random_joke():
-    """Get a random joke that hasn't been used recently."""
-    global recent_jokes, used_joke_indices
-    
-    # If we've used all jokes, reset the tracking
-    if len(used_joke_indices) >= len(JOKES):
-        used_joke_indices = set()
-        recent_jokes = []
-    
-    # Get a random joke that hasn't been used in this cycle
-    available_indices = set(range(len(JOKES))) - used_joke_indices
-    if not available_indices:
-        used_joke_indices = set()
-        recent_jokes = []
-        available_indices = set(range(len(JOKES)))
-    
-    # Choose a random index from available ones
-    chosen_index = random.choice(list(available_indices))
-    used_joke_indices.add(chosen_index)
-    joke = JOKES[chosen_index]
-    
-    # Add to recent jokes to prevent immediate repetition
-    recent_jokes.append(joke)
-    if len(recent_jokes) > 5:  # Keep track of last 5 jokes
-        recent_jokes.pop(0)
-        
-    return joke
-
-def get_random_quote():
-    """Get a random quote that hasn't been used recently."""
-    global recent_quotes, used_quote_indices
-    
-    # If we've used all quotes, reset the tracking
-    if len(used_quote_indices) >= len(QUOTES):
-        used_quote_indices = set()
-        recent_quotes = []
-    
-    # Get a random quote that hasn't been used in this cycle
-    available_indices = set(range(len(QUOTES))) - used_quote_indices
-    if not available_indices:
-        used_quote_indices = set()
-        recent_quotes = []
-        available_indices = set(range(len(QUOTES)))
-    
-    # Choose a random index from available ones
-    chosen_index = random.choice(list(available_indices))
-    used_quote_indices.add(chosen_index)
-    quote = QUOTES[chosen_index]
-    
-    # Add to recent quotes to prevent immediate repetition
-    recent_quotes.append(quote)
-    if len(recent_quotes) > 5:  # Keep track of last 5 quotes
-        recent_quotes.pop(0)
-        
-    return quote
-
-# Jokes database
-JOKES = [
-    "Sometimes I think back on all the people I’ve lost and remember why I stopped being a tour guide.",
-    "Give a man a match, and he’ll be warm for a few hours. Set him on fire, and he’ll be warm for the rest of his life.",
-    "You don’t need a parachute to go skydiving. You need a parachute to go skydiving twice.",
-    "My grandfather said my generation relies too much on the latest technology. I called him a hypocrite and unplugged his life support.",
-    "I’ll never forget my father’s last words to me just before he died: “Are you sure you fixed the brakes?”",
-    "My senior relatives liked to tease me at weddings, saying things like, “You’ll be next!” But they stopped after I started saying that to them at funerals.",
-    "Happy 70th birthday. At last, you can live undisturbed by life insurance agents!",
-    "Why is it that if you donate one kidney, people love you, but if you donate five kidneys, they call the police?",
-    "My mother told me, “One man’s trash is another man’s treasure.” Terrible way to learn I’m adopted.",
-    "How do you turn any salad into a Caesar salad? Stab it 23 times.",
-    "An apple a day keeps the doctor away… If you choke on it.",
-    "What’s the difference between a baby and a sweet potato? About 140 calories.",
-    "Why are cigarettes good for the environment? They kill people.",
-    "When does a dark joke become a dad joke? When it goes out for milk and never comes back.",
-"Doctor: “I’m afraid I have some very bad news: You’re dying and don’t have much time left.” Patient: “Oh, that’s terrible! Doc, how long have I got?” Doctor: “Ten.” Patient: “Ten? Ten what? Months? Weeks?!” Doctor: “Nine … eight…”",
-    "I'm not arguing, I'm just explaining why I'm right.",
-    "Parallel lines have so much in common… it's a shame they'll never meet.",
-    "Why don't skeletons fight each other? They don't have the guts.",
-    "My boss told me to have a good day… so I went home.",
-    "They say laughter is the best medicine. That's why I laugh at people with cancer.",
-    "Why do cows wear bells? Because their horns don't work.",
-    "Give a man a match, and he'll be warm for a few minutes. Set him on fire, and he’ll be warm for the rest of his life.",
-    "What's red and bad for your teeth? A brick",
-    "Some people graduate with honors. I am just honored to graduate.",
-    "Did you hear about the claustrophobic astronaut? He just needed a little space.",
-    "Why can’t orphans play baseball? Because they don’t know where home is.",
-    "I'm great at multitasking. I can waste time, be unproductive, and procrastinate all at once.",
-    "What's the difference between a snowman and a snowwoman? Snowballs.",
-    "I'm reading a book on anti-gravity. It's impossible to put down.",
-    "I'm not addicted to caffeine. We're just in a committed relationship.",
-    "I know they say that money talks, but all mine says is 'Goodbye.'",
-    "The man who invented autocorrect should burn in hello.",
-    "Life is short. Smile while you still have teeth.",
-    "I broke my finger last week. On the other hand, I'm okay.",
-    "I'm writing a book on reverse psychology. Don't buy it.",
-    "Some people graduate with honors, I am just honored to graduate.",
-    "Alcohol doesn't solve any problems, but neither does milk.",
-    "Dark humor is like food. Not everyone gets it.",
-    "I'm not short. I'm just more down to Earth than other people.",
-    "Sometimes I wonder if I'm a good person, then I remember I give people my Netflix password.",
-    "Whoever stole my copy of Microsoft Office, I will find you. You have my Word.",
-    "They say love is blind. Marriage is a real eye-opener.",
-    "Why did the golfer bring two pairs of pants? In case he got a hole in one.",
-    "If we shouldn't eat at night, why is there a light in the fridge?",
-    "I'm not weird. I'm limited edition.",
-    "I'm writing a book on how to fall down stairs. It's a step-by-step guide.",
-    "When life shuts a door… open it again. It's a door. That's how they work.",
-    "I tried to be normal once. Worst two minutes of my life.",
-    "Dear Math, I'm not a therapist. Solve your own problems.",
-    "Zombies eat brains. Don't worry, you're safe.",
-    "My password is the last 8 digits of π. Good luck.",
-    "People say nothing is impossible, but I do nothing every day.",
-    "If Monday had a face, I'd punch it.",
-    "Don't you hate it when someone answers their own questions? I do.",
-    "My life feels like a test I didn't study for.",
-    "I can handle pain. Until it hurts.",
-    "My brain has too many tabs open.",
-    "If I were a superhero, my power would be napping.",
-    "I asked Siri why I'm still single. She opened the front camera.",
-    "What's the difference between a piano and a dead body? I don’t play piano in my basement.",
-    "My favorite machine at the gym is the vending machine.",
-    "If at first you don't succeed, then skydiving definitely isn't for you.",
-    "Don't worry if plan A doesn't work out. There are 25 more letters.",
-    "The difference between stupidity and genius is that genius has its limits.",
-     "Why did the orphan rob the bank? To feel wanted.",
-    "Before you judge someone, walk a mile in their shoes. Then you're a mile away and you have their shoes."
-]
+# Per-chat no-repeat rotation through the jokes and quotes
+rotations = Rotations(os.getenv('ROTATION_STATE', 'rotation.json'))
 
-# Quotes database
-QUOTES = [
-    ("The only way to do great work is to love what you do.", "Steve Jobs"),
-    ("You may delay, but time will not.", "Benjamin Franklin"),
-    ("Procrastination is the art of keeping up with yesterday.", "Don Marquis"),
-    ("Life is what happens when you're busy making other plans.", "John Lennon"),
-    ("Don't watch the clock; do what it does. Keep going.", "Sam Levenson"),
-    ("Success is not final, failure is not fatal: it is the courage to continue that counts.", "Winston Churchill"),
-    ("Never put off till tomorrow what may be done day after tomorrow just as well.", "Mark Twain"),
-    ("In the middle of every difficulty lies opportunity.", "Albert Einstein"),
-    ("Procrastination is opportunity's assassin.", "Victor Kiam"),
-    ("Don't wait. The time will never be just right.", "Napoleon Hill"),
-    ("If you want to make an easy job seem mighty hard, just keep putting off doing it.", "Olin Miller"),
-    ("You miss 100% of the shots you don't take.", "Wayne Gretzky"),
-    ("A year from now you may wish you had started today.", "Karen Lamb"),
-    ("Amateurs sit and wait for inspiration, the rest of us just get up and go to work.", "Stephen King"),
-    ("Do not dwell in the past, do not dream of the future, concentrate the mind on the present moment.", "Buddha"),
-    ("Action is the foundational key to all success.", "Pablo Picasso"),
-    ("Only put off until tomorrow what you are willing to die having left undone.", "Pablo Picasso"),
-    ("Life is really simple, but we insist on making it complicated.", "Confucius"),
-    ("The future depends on what you do today.", "Mahatma Gandhi"),
-    ("The way to get started is to quit talking and begin doing.", "Walt Disney"),
-    ("It always seems impossible until it's done.", "Nelson Mandela"),
-    ("Time is a created thing. To say 'I don't have time' is like saying 'I don't want to.'", "Lao Tzu"),
-    ("Don't ruin a good today by thinking about a bad yesterday.", "Unknown"),
-    ("Someday is not a day of the week.", "Denise Brennan-Nelson"),
-    ("He who waits to do a great deal of good at once will never do anything.", "Samuel Johnson"),
-    ("Work while it is called today, for you know not how much you may be hindered tomorrow.", "Matthew Henry"),
-    ("You cannot escape the responsibility of tomorrow by evading it today.", "Abraham Lincoln"),
-    ("Procrastination is the grave in which opportunity is buried.", "Unknown"),
-    ("Do something today that your future self will thank you for.", "Sean Patrick Flanery"),
-    ("What is not started today is never finished tomorrow.", "Johann Wolfgang von Goethe"),
-    ("Life isn't about finding yourself. Life is about creating yourself.", "George Bernard Shaw"),
-    ("Things may come to those who wait, but only the things left by those who hustle.", "Abraham Lincoln"),
-    ("If you spend too much time thinking about a thing, you'll never get it done.", "Bruce Lee"),
-    ("Take time to deliberate; but when the time for action arrives, stop thinking and go in.", "Napoleon Bonaparte"),
-    ("Don't be pushed around by the fears in your mind. Be led by the dreams in your heart.", "Roy T. Bennett"),
-    ("Time is what we want most, but what we use worst.", "William Penn"),
-    ("If you wait, all that happens is you get older.", "Mario Andretti"),
-    ("The best way out is always through.", "Robert Frost"),
-    ("Time flies over us, but leaves its shadow behind.", "Nathaniel Hawthorne"),
-    ("Yesterday is gone. Tomorrow has not yet come. We have only today. Let us begin.", "Mother Teresa"),
-    ("Life is short, and it is up to you to make it sweet.", "Sarah Louise Delany"),
-    ("The key is not to prioritize what's on your schedule, but to schedule your priorities.", "Stephen Covey"),
-    ("You can't build a reputation on what you are going to do.", "Henry Ford"),
-    ("Motivation is what gets you started. Habit is what keeps you going.", "Jim Ryun"),
-    ("Don't let what you cannot do interfere with what you can do.", "John Wooden"),
-    ("Even if you're on the right track, you'll get run over if you just sit there.", "Will Rogers"),
-    ("If you're going through hell, keep going.", "Winston Churchill"),
-    ("A goal without a plan is just a wish.", "Antoine de Saint-Exupéry"),
-    ("Life begins at the end of your comfort zone.", "Neale Donald Walsch"),
-    ("Sometimes later becomes never. Do it now.", "Unknown"),
-    ("It does not matter how slowly you go as long as you do not stop.", "Confucius"),
-    ("Start where you are. Use what you have. Do what you can.", "Arthur Ashe"),
-    ("Hard work beats talent when talent doesn't work hard.", "Tim Notke"),
-    ("Discipline is choosing between what you want now and what you want most.", "Abraham Lincoln"),
-    ("Don't wait for inspiration. It comes while one is working.", "Henri Matisse"),
-    ("The expert in anything was once a beginner.", "Helen Hayes"),
-    ("Success usually comes to those who are too busy to be looking for it.", "Henry David Thoreau"),
-    ("The trouble is, you think you have time.", "Jack Kornfield"),
-    ("Life is 10% what happens to you and 90% how you react to it.", "Charles R. Swindoll"),
-    ("Make each day your masterpiece.", "John Wooden"),
-    ("You must be the change you wish to see in the world.", "Mahatma Gandhi"),
-    ("The man who moves a mountain begins by carrying away small stones.", "Confucius"),
-    ("A journey of a thousand miles begins with a single step.", "Lao Tzu"),
-    ("You get in life what you have the courage to ask for.", "Oprah Winfrey"),
-    ("Dream big and dare to fail.", "Norman Vaughan"),
-    ("Opportunities are usually disguised as hard work, so most people don't recognize them.", "Ann Landers"),
-    ("Don't count the days, make the days count.", "Muhammad Ali"),
-    ("I never dreamed about success. I worked for it.", "Estée Lauder"),
-    ("Either you run the day, or the day runs you.", "Jim Rohn"),
-    ("There are no shortcuts to any place worth going.", "Beverly Sills"),
-    ("Don't be afraid to give up the good to go for the great.", "John D. Rockefeller"),
-    ("If you don't design your own life plan, chances are you'll fall into someone else's plan.", "Jim Rohn"),
-    ("If not now, when?", "Hillel the Elder"),
-    ("Success is getting what you want. Happiness is wanting what you get.", "Dale Carnegie"),
-    ("The secret of getting ahead is getting started.", "Mark Twain"),
-    ("You don't have to be great to start, but you have to start to be great.", "Zig Ziglar"),
-    ("Great acts are made up of small deeds.", "Lao Tzu"),
-    ("Your time is limited, so don't waste it living someone else's life.", "Steve Jobs"),
-    ("Lost time is never found again.", "Benjamin Franklin"),
-    ("A wise person does at once what a fool does at last.", "Baltasar Gracián"),
-    ("Don't wait until everything is just right. It will never be perfect.", "Mark Victor Hansen"),
-    ("Better three hours too soon than a minute too late.", "William Shakespeare"),
-    ("If you want to achieve greatness stop asking for permission.", "Anonymous"),
-    ("Push yourself, because no one else is going to do it for you.", "Anonymous"),
-    ("The best time to plant a tree was 20 years ago. The second best time is now.", "Chinese Proverb"),
-    ("Don't limit your challenges. Challenge your limits.", "Jerry Dunn"),
-    ("You can't cross the sea merely by standing and staring at the water.", "Rabindranath Tagore"),
-    ("What lies behind us and what lies before us are tiny matters compared to what lies within us.", "Ralph Waldo Emerson"),
-    ("Believe you can and you're halfway there.", "Theodore Roosevelt"),
-    ("You don't need more time, you just need to decide.", "Seth Godin"),
-    ("Doing nothing is very hard to do… you never know when you're finished.", "Leslie Nielsen"),
-    ("Delaying tactics are the art of self-sabotage.", "Unknown"),
-    ("You have to expect things of yourself before you can do them.", "Michael Jordan"),
-    ("Don't wait for the perfect moment. Take the moment and make it perfect.", "Unknown"),
-    ("Just do it.", "Nike"),
-    ("Stop waiting. Start creating.", "Unknown"),
-    ("You can't start the next chapter if you keep re-reading the last one.", "Unknown"),
-    ("Do it now. Sometimes 'later' becomes 'never'.", "Unknown")
-]
+def get_random_joke(chat_id):
+    """Get the next joke in this chat's rotation."""
+    return JOKES[rotations.draw('jokes', chat_id, len(JOKES))]
+
+def get_random_quote(chat_id):
+    """Get the next quote in this chat's rotation."""
+    return QUOTES.fields(rotations.draw('quotes', chat_id, len(QUOTES)))
 
-TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-if not TOKEN or TOKEN == 'your_bot_token_here':
-    logger.error('No valid bot token found in .env file')
-    exit(1)
+# Jokes and quotes are memory-mapped from content/*.corpus, built from the JSON sources next to them
+CONTENT_DIR = os.getenv('CONTENT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content'))
+JOKES = Corpus(os.path.join(CONTENT_DIR, 'jokes.corpus'), source=os.path.join(CONTENT_DIR, 'jokes.json'))
+QUOTES = Corpus(os.path.join(CONTENT_DIR, 'quotes.corpus'), source=os.path.join(CONTENT_DIR, 'quotes.json'))
+
+# Senders over this rate aren't counted and get no answers; chats over theirs get no more answers
+user_flood = SlidingWindow(
+    limit=int(os.getenv('FLOOD_USER_LIMIT', '20')),
+    window=float(os.getenv('FLOOD_USER_WINDOW_SECONDS', '10')),
+    name='user_id'
+)
+chat_commands = SlidingWindow(
+    limit=int(os.getenv('FLOOD_CHAT_COMMANDS', '30')),
+    window=float(os.getenv('FLOOD_CHAT_WINDOW_SECONDS', '60')),
+    name='chat_id'
+)
+
+def flood_gate(update: Update, context: CallbackContext):
+    """Stop text messages and commands over the flood limits before they are counted or answered."""
+    message = update.message
+    if not message or not message.text or not update.effective_user:
+        return
+    
+    # Message dates rather than the clock, so replays of recorded traffic are throttled the same way
+    now = message.date.timestamp()
+    if not user_flood.hit(update.effective_user.id, now):
+        raise DispatcherHandlerStop()
+    # Only commands from senders who got through count against the chat, so one flooder can't use it up
+    if message.text.startswith('/') and not chat_commands.hit(message.chat_id, now):
+        raise DispatcherHandlerStop()
 
 def track_activity(update: Update, context: CallbackContext):
     """Track user activity for active member stats."""
     if not update.message or not update.effective_user:
         return
     
-    user_id = update.effective_user.id
-    now = datetime.now()
-    
-    # Update user activity
-    active_members[user_id]['messages'] += 1
-    active_members[user_id]['last_active'] = now
-    active_members[user_id]['username'] = update.effective_user.username or f"user_{user_id}"
-    active_members[user_id]['full_name'] = update.effective_user.full_name
-    
-    # Update weekly and monthly stats
-    weekly_stats[user_id] += 1
-    monthly_stats[user_id] += 1
-    
-    # Reset weekly stats every Monday
-    if (now - last_weekly_reset).days >= 7 and now.weekday() == 0:  # Monday
-        weekly_stats.clear()
-        last_weekly_reset = now
-    
-    # Reset monthly stats on the first day of the month
-    if now.month != last_monthly_reset.month:
-        monthly_stats.clear()
-        last_monthly_reset = now
+    # Members without a username are shown as user_<id> when the leaderboard is rendered
+    user = update.effective_user
+    activity.record(update.effective_chat.id, user.id, user.username, user.full_name)
 
 def send_random_sticker(chat_id, context):
-    """Send a random emoji as a sticker to the chat."""
-    try:
-        # Choose a random emoji from our list
-        emoji = random.choice(EMOJI_STICKERS)
-        
-        # Send the emoji as a sticker
-        context.bot.send_sticker(
-            chat_id=chat_id,
-            sticker=emoji
-        )
-        return True
-        
-    except Exception as e:
-        # If sending as a sticker fails, send the emoji as text
-        logger.warning(f"Failed to send emoji as sticker: {e}")
-        try:
-            context.bot.send_message(
-                chat_id=chat_id,
-                text=f"{emoji} {emoji} {emoji}",
-                parse_mode=ParseMode.HTML
-            )
-            return True
-        except Exception as e2:
-            logger.error(f"Failed to send fallback message: {e2}")
-            return False
+    """Queue a random sticker from the catalogue, or the emoji as text if none is known."""
+    # Choose a random emoji from our list
+    emoji = random.choice(EMOJI_STICKERS)
+    text = f"{emoji} {emoji} {emoji}"
+    
+    file_id = stickers.pick(emoji) or stickers.pick()
+    if file_id is None:
+        # No resolved sticker to send: one text message instead of a doomed send_sticker
+        return outbox.send_message(chat_id, text, PRIORITY_STICKER, merge_key='sticker', parse_mode=ParseMode.HTML)
+    
+    # If sending the sticker fails, the outbox sends the emoji as text instead
+    return outbox.send_sticker(
+        chat_id,
+        file_id,
+        merge_key='sticker',
+        fallback=('send_message', {'text': text, 'parse_mode': ParseMode.HTML})
+    )
 
 def sticker(update: Update, context: CallbackContext):
     """Send a random sticker."""
-    try:
-        # Send a typing action to show the bot is working
-        context.bot.send_chat_action(
-            chat_id=update.effective_chat.id,
-            action='typing'
-        )
-        
-        max_attempts = 3
-        for attempt in range(max_attempts):
-            try:
-                send_random_sticker(update.effective_chat.id, context)
-                return  # Success, exit the function
-                
-            except Exception as e:
-                logger.error(f"Sticker attempt {attempt + 1} failed: {e}")
-                if attempt == max_attempts - 1:  # Last attempt
-                    raise
-                time.sleep(1)  # Wait before retry
-                
-    except Exception as e:
-        logger.error(f"All sticker attempts failed: {e}")
-        try:
+    chat_id = update.effective_chat.id
+    
+    # Send a typing action to show the bot is working
+    outbox.submit('send_chat_action', chat_id, PRIORITY_STICKER, merge_key='typing', action='typing')
+    
+    # Retries and the circuit breaker live in the outbox, so no worker thread sleeps here
+    def on_done(future):
+        if future.exception() is not None:
+            logger.error(f"All sticker attempts failed: {future.exception()}")
             # As a last resort, try to send a text message
-            update.message.reply_text(
+            outbox.reply(
+                update.message,
                 "🎭 Sticker service is temporarily unavailable. "
                 "I'll be back with more stickers soon! 🎨"
             )
-        except Exception as text_error:
-            logger.error(f"Failed to send error message: {text_error}")
+    
+    send_random_sticker(chat_id, context).add_done_callback(on_done)
 
 def start(update: Update, context: CallbackContext):
     """Send a message when the command /start is issued."""
-    logger.info(f"Start command received from {update.effective_user.id}")
+    logger.info("Start command received from %s", update.effective_user.id,
+                extra={'event': 'command', 'command': 'start', 'chat_id': update.effective_chat.id})
     try:
         # Send welcome message
-        update.message.reply_text(
+        outbox.reply(
+            update.message,
             '👋 Welcome to the group! I am your welcome bot.\n\n'
             'Available commands:\n'
             '/joke - Get a random joke\n'
             '/quote - Get an inspirational quote\n'
             '/sticker - Get a random sticker\n'
-            '/topweekly - Show most active members this week\n'
-            '/topmonthly - Show most active members this month'
+            '/topweekly - Show most active members of the last 7 days\n'
+            '/topmonthly - Show most active members of the last 30 days\n'
+            '/top 3d - Show most active members of the last 3 days\n'
+            '/export - Admins: download this chat\'s activity as CSV (/export daily gz)'
         )
         
         # Send a welcome sticker
@@ -407,212 +221,372 @@ def start(update: Update, context: CallbackContext):
 def joke(update: Update, context: CallbackContext):
     """Send a random joke."""
     try:
-        joke = get_random_joke()
-        update.message.reply_text(f"🎭 {joke}")
+        joke = get_random_joke(update.effective_chat.id)
+        outbox.reply(update.message, f"🎭 {joke}")
     except Exception as e:
         logger.error(f"Error in joke command: {e}")
-        update.message.reply_text("I'm all out of jokes for now!")
+        outbox.reply(update.message, "I'm all out of jokes for now!")
 
 def quote(update: Update, context: CallbackContext):
     """Send a random inspirational quote."""
     try:
-        quote, author = get_random_quote()
-        update.message.reply_text(f'"{quote}"\n— {author}')
+        quote, author = get_random_quote(update.effective_chat.id)
+        outbox.reply(update.message, f'"{quote}"\n— {author}')
     except Exception as e:
         logger.error(f"Error in quote command: {e}")
-        update.message.reply_text("I'm fresh out of wisdom for now!")
+        outbox.reply(update.message, "I'm fresh out of wisdom for now!")
+
+def page_keyboard(snapshot_id, snapshot, page):
+    """Prev/Next buttons for a leaderboard page, or None when everything fits on one page."""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("« Prev", callback_data=f"lb:{snapshot_id}:{page - 1}"))
+    if page < snapshot.pages - 1:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=f"lb:{snapshot_id}:{page + 1}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def send_leaderboard(update, days, merge_key):
+    """Reply with the first page of a snapshot of the ``days``-day leaderboard."""
+    chat_id = update.effective_chat.id
+    stats = activity.chat(chat_id)
+    board = stats.board(days)
+    if not board:
+        outbox.reply(update.message, f"No activity in the last {days} days yet!")
+        return
+    
+    snapshot_id, snapshot = snapshots.take(
+        chat_id, days, board, stats.members, f"Top Active Members (Last {days} Days)"
+    )
+    outbox.reply(
+        update.message,
+        snapshot.page(0),
+        merge_key=merge_key,
+        parse_mode='HTML',
+        reply_markup=page_keyboard(snapshot_id, snapshot, 0)
+    )
+
+def post_digest(chat_id, snapshot):
+    """Post the first page of a digest snapshot, with buttons for the rest; returns the send's Future."""
+    snapshot_id = snapshots.put(snapshot)
+    return outbox.send_message(
+        chat_id,
+        snapshot.page(0),
+        parse_mode='HTML',
+        reply_markup=page_keyboard(snapshot_id, snapshot, 0)
+    )
+
+# Leaderboards of each finished week and month, posted to every group that had activity
+digests = Digests(
+    activity,
+    post_digest,
+    kinds=[kind for kind in os.getenv('DIGESTS', 'weekly,monthly').split(',') if kind],
+    spread=float(os.getenv('DIGEST_SPREAD_SECONDS', '3600')),
+    size=activity.board_size,
+    catch_up=float(os.getenv('DIGEST_CATCH_UP_HOURS', '48')) * 3600
+)
 
 def top_weekly(update: Update, context: CallbackContext):
-    """Show most active members this week."""
+    """Show most active members over the last 7 days."""
     try:
-        if not weekly_stats:
-            update.message.reply_text("No activity stats for this week yet!")
-            return
-            
-        sorted_users = sorted(weekly_stats.items(), key=lambda x: x[1], reverse=True)[:10]
-        message = "🏆 *Top Active Members This Week* 🏆\n\n"
-        
-        for idx, (user_id, count) in enumerate(sorted_users, 1):
-            user = active_members.get(user_id, {})
-            username = user.get('username', f"user_{user_id}")
-            full_name = user.get('full_name', 'Unknown User')
-            message += f"{idx}. {full_name} (@{username}): {count} messages\n"
-            
-        update.message.reply_text(message, parse_mode='Markdown')
+        send_leaderboard(update, 7, 'topweekly')
     except Exception as e:
         logger.error(f"Error in top_weekly command: {e}")
-        update.message.reply_text("Couldn't fetch weekly stats right now.")
+        outbox.reply(update.message, "Couldn't fetch weekly stats right now.")
 
 def top_monthly(update: Update, context: CallbackContext):
-    """Show most active members this month."""
+    """Show most active members over the last 30 days."""
+    try:
+        send_leaderboard(update, 30, 'topmonthly')
+    except Exception as e:
+        logger.error(f"Error in top_monthly command: {e}")
+        outbox.reply(update.message, "Couldn't fetch monthly stats right now.")
+
+def top_window(update: Update, context: CallbackContext):
+    """Show most active members over a custom window, e.g. /top 3d."""
+    try:
+        days = 7
+        if context.args:
+            arg = context.args[0].lower()
+            if not arg.endswith('d') or not arg[:-1].isdigit() or not 1 <= int(arg[:-1]) <= MAX_WINDOW_DAYS:
+                outbox.reply(update.message, f"Usage: /top <days>d, with up to {MAX_WINDOW_DAYS} days (e.g. /top 3d)")
+                return
+            days = int(arg[:-1])
+        
+        send_leaderboard(update, days, 'top')
+    except Exception as e:
+        logger.error(f"Error in top command: {e}")
+        outbox.reply(update.message, "Couldn't fetch stats right now.")
+
+# Activity exports are written to a temporary file by a worker thread and uploaded through the outbox
+exporter = Exporter(
+    activity.path,
+    workers=int(os.getenv('EXPORT_WORKERS', '1')),
+    chunk_rows=int(os.getenv('EXPORT_CHUNK_ROWS', '1000'))
+)
+
+# The Bot API refuses bot uploads over 50 MB
+MAX_EXPORT_BYTES = 50 * 1024 * 1024
+
+def run_export(bot, message, daily, compress):
+    """Build an export for an admin and queue its upload; runs on an export thread."""
+    chat_id = message.chat_id
     try:
-        if not monthly_stats:
-            update.message.reply_text("No activity stats for this month yet!")
+        status = bot.get_chat_member(chat_id, message.from_user.id).status
+        if status not in ('creator', 'administrator'):
+            outbox.reply(message, "Only admins can export the chat's activity.")
             return
-            
-        sorted_users = sorted(monthly_stats.items(), key=lambda x: x[1], reverse=True)[:10]
-        message = "🏆 *Top Active Members This Month* 🏆\n\n"
         
-        for idx, (user_id, count) in enumerate(sorted_users, 1):
-            user = active_members.get(user_id, {})
-            username = user.get('username', f"user_{user_id}")
-            full_name = user.get('full_name', 'Unknown User')
-            message += f"{idx}. {full_name} (@{username}): {count} messages\n"
-            
-        update.message.reply_text(message, parse_mode='Markdown')
+        # Counts still waiting for the flusher belong in the export
+        activity.flush()
+        path, rows = exporter.write(chat_id, daily, compress)
     except Exception as e:
-        logger.error(f"Error in top_monthly command: {e}")
-        update.message.reply_text("Couldn't fetch monthly stats right now.")
+        logger.error(f"Error building export for chat {chat_id}: {e}")
+        outbox.reply(message, "Couldn't build the export right now.")
+        return
+    
+    try:
+        size = os.path.getsize(path)
+        if size > MAX_EXPORT_BYTES:
+            outbox.reply(message, f"The export is {size // 2 ** 20} MB, too large for Telegram; try /export gz.")
+            return
+        # Read once, so a send that is retried after flood control uploads the same bytes again
+        with open(path, 'rb') as f:
+            document = f.read()
+    finally:
+        os.unlink(path)
+    
+    filename = f"activity-{'daily-' if daily else ''}{abs(chat_id)}-{datetime.now():%Y%m%d}.csv"
+    if compress:
+        filename += '.gz'
+    outbox.submit(
+        'send_document',
+        chat_id,
+        document=document,
+        filename=filename,
+        caption=f"📊 {rows} rows",
+        reply_to_message_id=message.message_id,
+        allow_sending_without_reply=True,
+        timeout=120
+    )
+    logger.info(f"Exported {rows} rows ({size} bytes) from chat {chat_id}")
+
+def export(update: Update, context: CallbackContext):
+    """Send the chat's activity as a CSV file, per member or (/export daily) per day; gz compresses it."""
+    try:
+        if update.effective_chat.type == 'private':
+            outbox.reply(update.message, "Use /export in a group to get its activity.")
+            return
+        args = {arg.lower() for arg in context.args}
+        if not args <= {'daily', 'gz'}:
+            outbox.reply(update.message, "Usage: /export [daily] [gz]")
+            return
+        
+        # The admin check, the database read and the file all happen off the dispatcher thread
+        queued = exporter.submit(
+            update.effective_chat.id,
+            lambda: run_export(context.bot, update.message, 'daily' in args, 'gz' in args)
+        )
+        if not queued:
+            outbox.reply(update.message, "An export of this chat is already on its way.")
+    except Exception as e:
+        logger.error(f"Error in export command: {e}")
+        outbox.reply(update.message, "Couldn't start the export right now.")
+
+# Button presses are acknowledged from these threads, so the call never holds up the dispatcher
+CALLBACK_ANSWER_WORKERS = 2
+callback_answers = ThreadPoolExecutor(CALLBACK_ANSWER_WORKERS, thread_name_prefix='answer')
+
+def answer_query(query, text=None):
+    """Acknowledge a button press (stopping its spinner) off the dispatcher thread."""
+    def answer():
+        try:
+            query.answer(text)
+        except Exception as e:
+            logger.warning(f"Couldn't answer callback query: {e}")
+    callback_answers.submit(answer)
+
+def leaderboard_page(update: Update, context: CallbackContext):
+    """Turn a leaderboard message to another page of its snapshot."""
+    query = update.callback_query
+    message = query.message
+    try:
+        _, snapshot_id, page = query.data.split(':')
+        page = int(page)
+        snapshot = snapshots.get(snapshot_id)
+        # Edits of one message merge, so a burst of clicks only sends the last page
+        merge_key = f"page:{message.message_id}"
+        if snapshot is None or not 0 <= page < snapshot.pages:
+            answer_query(query, "This leaderboard has expired, run the command again.")
+            outbox.submit('edit_message_reply_markup', message.chat_id, merge_key=merge_key,
+                          message_id=message.message_id, reply_markup=None)
+            return
+        
+        answer_query(query)
+        outbox.submit(
+            'edit_message_text',
+            message.chat_id,
+            merge_key=merge_key,
+            message_id=message.message_id,
+            text=snapshot.page(page),
+            parse_mode='HTML',
+            reply_markup=page_keyboard(snapshot_id, snapshot, page)
+        )
+    except Exception as e:
+        logger.error(f"Error turning leaderboard page: {e}")
 
 def left_chat_member(update: Update, context: CallbackContext):
     """Send a message when a member leaves the group."""
     left_member = update.message.left_chat_member
+    if left_member:
+        member_counts.adjust(update.effective_chat.id, -1)
     if left_member and left_member.id != context.bot.id:  # Don't send message if bot is the one who left
         try:
-            update.message.reply_text(
+            outbox.reply(
+                update.message,
                 f"👋 {left_member.mention_html()}, we're sorry to see you go! You'll be missed!",
+                PRIORITY_WELCOME,
                 parse_mode='HTML'
             )
         except Exception as e:
-            logger.error(f"Error sending left chat message: {e}")
+            logger.error("Error sending left chat message: %s", e, extra={'event': 'left'})
 
-def new_member(update: Update, context: CallbackContext):
-    """Send a welcome message when a new member joins the group."""
-    logger.info("=== NEW MEMBER DETECTED ===")
-    logger.info(f"Update content: {update}")
+# Batch members that join in quick succession into a single welcome
+MAX_WELCOME_MENTIONS = 50
+WELCOME_STICKER_EMOJIS = ['👋', '🎉', '🎊']
+
+def welcome_members(bot, batch):
+    """Greet everyone in a join batch with one message and at most one sticker."""
+    members = batch.members
     
-    # Check if this is a message with new chat members
-    if update.message and update.message.new_chat_members:
-        logger.info(f"Processing new chat members in message {update.message.message_id}")
-        logger.info(f"Chat ID: {update.effective_chat.id}")
-        logger.info(f"Chat type: {update.effective_chat.type}")
-        logger.info(f"New members: {update.message.new_chat_members}")
-        
-        for member in update.message.new_chat_members:
-            # Skip if the new member is the bot itself
-            if member.is_bot and member.id == context.bot.id:
-                logger.info("Bot was added to the group")
-                continue
-                
-            try:
-                # Get member count
-                chat_member_count = context.bot.get_chat_member_count(update.effective_chat.id)
-                
-                # Create welcome message with proper MarkdownV2 escaping
-                welcome_msg = (
-                    f"👋 Welcome {member.mention_markdown_v2()} to the group!\n"
-                    f"You are member {'#' + str(chat_member_count)} 🎉"
-                )
-                
-                # Send welcome message
-                context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=welcome_msg,
-                    parse_mode='MarkdownV2',
-                    reply_to_message_id=update.message.message_id
-                )
-                
-                # Send a welcome sticker
-                send_random_sticker(update.effective_chat.id, context)
-                logger.info(f"Welcome message sent to {member.full_name}")
-                
-            except Exception as e:
-                logger.error(f"Error welcoming {member.full_name}: {e}")
-    else:
-        logger.warning("No new members found in the update")
+    # One member count lookup for the whole batch, usually served from cache; the welcome goes out without it
+    try:
+        chat_member_count = member_counts.get(bot, batch.chat_id)
+    except Exception as e:
+        logger.warning(f"Couldn't get member count: {e}")
+        chat_member_count = None
     
-    if not update.message.new_chat_members:
-        logger.warning("No new members found in the update")
-        return
+    if len(members) == 1:
+        member = members[0]
         
-    for member in update.message.new_chat_members:
-        try:
-            # Check if the new member is the bot itself
-            if member.is_bot and member.id == context.bot.id:
-                logger.info("Bot was added to a new group")
-                update.message.reply_text(
-                    "🤖 Thanks for adding me! I'll welcome new members to this group. "
-                    "Make me an admin to get the best experience! 🚀"
-                )
-                return
-            
-            # Get member count for fun stats
-            chat_member_count = context.bot.get_chat_member_count(update.effective_chat.id)
-            
-            # Random emoji for variety
-            import random
-            emojis = ["👋", "🎉", "🌟", "✨", "🙌", "🤗", "😊", "🎊", "👏", "💫"]
-            welcome_emoji = random.choice(emojis)
-            
-            # Different welcome messages for variety
+        # Random emoji for variety
+        emojis = ["👋", "🎉", "🌟", "✨", "🙌", "🤗", "😊", "🎊", "👏", "💫"]
+        welcome_emoji = random.choice(emojis)
+        
+        # Different welcome messages for variety
+        if chat_member_count is None:
+            welcome_messages = [
+                f"👋 Welcome aboard MATE, {member.mention_html()}! 🎉\n"
+                f"Thrilled to have you join us!"
+            ]
+        else:
             welcome_messages = [
-                f"👋 Welcome aboard MATE, {member.mention_markdown_v2()}! 🎉\n"
+                f"👋 Welcome aboard MATE, {member.mention_html()}! 🎉\n"
                 f"You're member #{chat_member_count}!",
                 
-                f"👋 Welcome aboard MATE, {member.mention_markdown_v2()}! 🎉\n"
+                f"👋 Welcome aboard MATE, {member.mention_html()}! 🎉\n"
                 f"Great to have you as member #{chat_member_count}!",
                 
-                f"👋 Welcome aboard MATE, {member.mention_markdown_v2()}! 🎉\n"
+                f"👋 Welcome aboard MATE, {member.mention_html()}! 🎉\n"
                 f"Thrilled to have you join us! You're member #{chat_member_count}"
             ]
-            
-            # Get user profile photo if available
-            try:
-                photos = context.bot.get_user_profile_photos(member.id, limit=1)
-                has_photo = bool(photos.photos)
-            except Exception as e:
-                logger.warning(f"Couldn't get profile photo: {e}")
-                has_photo = False
-            
-            # Custom message based on whether user has profile photo
-            if has_photo:
-                welcome_messages.append(
-                    f"{welcome_emoji} *Welcome* {member.mention_markdown_v2()}! {welcome_emoji}\n"
-                    f"Love your profile picture! 😍"
-                )
-            
-            # Randomly select a welcome message
-            welcome_message = random.choice(welcome_messages)
-            
-            # Add some footer text
-            welcome_message += "\n\n_Type /help to see what I can do!"
-            
-            # Send the welcome message
-            update.message.reply_text(
-                welcome_message,
-                parse_mode='MarkdownV2',
-                disable_web_page_preview=True
-            )
-            
-            # Send a fun sticker (optional)
-            stickers = [
-                'CAACAgIAAxkBAAELVf5mB2h2Z2X2Z2ZmZmZmZmZmZmZmZgACAgADwDZPE_lqX5qCaCaeNAQ',  # 👋 wave
-                'CAACAgIAAxkBAAELVgBmB2iBZ2X2Z2ZmZmZmZmZmZmZmZgACAwADwDZPE1mWbkw5XzQlNAQ',  # 🎉 tada
-                'CAACAgIAAxkBAAELVgJmB2iJZ2X2Z2ZmZmZmZmZmZmZmZgACBAADwDZPE1mWbkw5XzQlNAQ'   # 🎊 confetti
-            ]
-            try:
-                context.bot.send_sticker(
-                    chat_id=update.effective_chat.id,
-                    sticker=random.choice(stickers),
-                    reply_to_message_id=update.message.message_id
-                )
-            except Exception as e:
-                logger.warning(f"Couldn't send sticker: {e}")
-                
+        
+        # Get user profile photo if available
+        try:
+            has_photo = profile_photos.has_photo(bot, member.id)
         except Exception as e:
-            logger.error(f"Error in new_member: {e}")
-            try:
-                # Fallback simple welcome with HTML parsing instead of Markdown
-                update.message.reply_text(
-                    f"👋 Welcome aboard MATE, {member.mention_html()}! 🎉",
-                    parse_mode='HTML'
-                )
-            except Exception as fallback_error:
-                logger.error(f"Fallback welcome failed: {fallback_error}")
+            logger.warning(f"Couldn't get profile photo: {e}")
+            has_photo = False
+        
+        # Custom message based on whether user has profile photo
+        if has_photo:
+            welcome_messages.append(
+                f"{welcome_emoji} <b>Welcome</b> {member.mention_html()}! {welcome_emoji}\n"
+                f"Love your profile picture! 😍"
+            )
+        
+        # Randomly select a welcome message
+        welcome_message = random.choice(welcome_messages)
+    else:
+        mentions = ", ".join(member.mention_html() for member in members[:MAX_WELCOME_MENTIONS])
+        if len(members) > MAX_WELCOME_MENTIONS:
+            mentions += f" and {len(members) - MAX_WELCOME_MENTIONS} more"
+        welcome_message = f"👋 Welcome aboard MATES, {mentions}! 🎉"
+        if chat_member_count is not None:
+            first = chat_member_count - len(members) + 1
+            welcome_message += f"\nYou're members #{first}–#{chat_member_count}!"
+    
+    # Add some footer text
+    welcome_message += "\n\n<i>Type /help to see what I can do!</i>"
+    
+    # Send the welcome message
+    outbox.send_message(
+        batch.chat_id,
+        welcome_message,
+        PRIORITY_WELCOME,
+        parse_mode='HTML',
+        disable_web_page_preview=True,
+        reply_to_message_id=batch.reply_to_message_id,
+        allow_sending_without_reply=True
+    )
+    
+    # Send a fun sticker (optional)
+    file_id = stickers.pick(random.choice(WELCOME_STICKER_EMOJIS))
+    if file_id:
+        outbox.send_sticker(batch.chat_id, file_id, merge_key='sticker')
+    logger.info("Welcome message sent to %d member(s) in chat %s", len(members), batch.chat_id,
+                extra={'event': 'welcome', 'chat_id': batch.chat_id, 'members': len(members)})
+
+# Member counts are seeded from the API and then kept current from join/leave events
+member_counts = MemberCountCache(ttl=float(os.getenv('MEMBER_COUNT_TTL_SECONDS', '900')))
+profile_photos = ProfilePhotoCache(ttl=float(os.getenv('PROFILE_PHOTO_TTL_SECONDS', '86400')))
+
+joins = JoinCoalescer(welcome_members, window=float(os.getenv('WELCOME_WINDOW_SECONDS', '3')))
+
+# Updates processed recently, so ones delivered again after a restart or webhook retry are dropped
+seen_updates = SeenUpdates(
+    os.getenv('SEEN_UPDATES', 'seen_updates.json'),
+    maxsize=int(os.getenv('SEEN_UPDATES_SIZE', '10000'))
+)
+
+# Optional capture of incoming updates for offline replay with tools/replay_updates.py
+update_log = None
+if os.getenv('UPDATE_LOG'):
+    update_log = UpdateRecorder(os.environ['UPDATE_LOG'], anonymise=os.getenv('UPDATE_LOG_ANONYMISE') == '1')
+
+def new_member(update: Update, context: CallbackContext):
+    """Queue new members for a batched welcome."""
+    # Check if this is a message with new chat members
+    if not update.message or not update.message.new_chat_members:
+        logger.warning("No new members found in the update")
+        return
+        
+    logger.info("%d new member(s) in chat %s", len(update.message.new_chat_members), update.effective_chat.id,
+                extra={'event': 'join', 'chat_id': update.effective_chat.id,
+                       'chat_type': update.effective_chat.type,
+                       'message_id': update.message.message_id})
+    logger.debug("Join update: %s", update, extra={'event': 'join_update'})
+    
+    members = []
+    for member in update.message.new_chat_members:
+        # Check if the new member is the bot itself
+        if member.is_bot and member.id == context.bot.id:
+            logger.info("Bot was added to a new group", extra={'event': 'added', 'chat_id': update.effective_chat.id})
+            outbox.reply(
+                update.message,
+                "🤖 Thanks for adding me! I'll welcome new members to this group. "
+                "Make me an admin to get the best experience! 🚀",
+                PRIORITY_WELCOME
+            )
+            continue
+        members.append(member)
+    
+    if members:
+        member_counts.adjust(update.effective_chat.id, len(members))
+        joins.add(update.effective_chat.id, members, update.message.message_id, context)
 
 def error_handler(update: object, context: CallbackContext): 
     """Log errors caused by Updates."""
-    logger.error(f"Error while processing update: {update}", exc_info=context.error)
+    logger.error("Error while processing update: %s", update, exc_info=context.error)
 
 def check_bot_info(bot):
     """Check bot info and permissions."""
@@ -624,45 +598,368 @@ def check_bot_info(bot):
         logger.error(f"Failed to get bot info: {e}")
         return False
 
+# Every update is handled in arrival order on the one dispatcher thread, which keeps each chat's updates
+# in order; anything slow is handed to the outbox, the job queue or an executor. No handler is run_async,
+# so PTB's worker pool gets a single thread, the least it runs without a warning. SHARDS is the way to scale out
+RUN_ASYNC_WORKERS = 1
+
+# Threads the JobQueue runs jobs on: welcome batches, digests, sticker refreshes and the periodic saves
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '10'))
+
+def create_job_queue(job_queue=None):
+    """A JobQueue (or ``job_queue``, not yet started) whose jobs run on JOB_WORKERS threads."""
+    job_queue = job_queue or JobQueue()
+    # Added before the scheduler starts, which only creates its default executor if there is none;
+    # scheduler.configure() would also reset the UTC timezone PTB sets
+    job_queue.scheduler.add_executor(JobExecutor(JOB_WORKERS), 'default')
+    return job_queue
+
+def create_bot(token):
+    """Bot with a Bot API connection pool that times every call.
+
+    The pool is shared by every thread that calls the Bot API: the outbox
+    senders, the run_async worker, the export threads, the
+    JOB_WORKERS job threads, the callback answer threads, and the dispatcher
+    and polling threads with a few to spare.
+    """
+    return Bot(
+        token,
+        # Another Bot API server, e.g. tools/fake_bot_api.py for benchmarks
+        base_url=os.getenv('TELEGRAM_BASE_URL') or None,
+        request=InstrumentedRequest(con_pool_size=outbox.workers + RUN_ASYNC_WORKERS + exporter.workers + JOB_WORKERS + CALLBACK_ANSWER_WORKERS + 4)
+    )
+
+def create_persistence(shard=None):
+    """Journal-backed persistence for user/chat/bot data, one per shard in sharded mode."""
+    path = os.getenv('PERSISTENCE_PATH', 'bot_state')
+    return JournalPersistence(
+        path if shard is None else shard_path(path, shard),
+        compact_every=int(os.getenv('PERSISTENCE_COMPACT_EVERY', '1000')),
+        fsync=os.getenv('PERSISTENCE_FSYNC') == '1',
+        # State saved by the PicklePersistence used before is imported on first start
+        legacy_pickle='bot_data' if shard is None else shard_path('bot_data', shard)
+    )
+
+def register_handlers(dp):
+    """Add every update handler to a dispatcher."""
+    # Report startup timing when the first update arrives
+    dp.add_handler(TypeHandler(Update, profiler.first_update), group=-100)
+    # Duplicates stop here, before they are recorded, counted or welcomed
+    dp.add_handler(TypeHandler(Update, seen_updates.check), group=-99)
+    if update_log:
+        dp.add_handler(TypeHandler(Update, update_log.record), group=-98)
+    dp.add_handler(TypeHandler(Update, flood_gate), group=-97)
+    
+    # Add command handlers; every handler records its latency and errors
+    dp.add_handler(CommandHandler("start", timed('start', start)))
+    dp.add_handler(CommandHandler("joke", timed('joke', joke)))
+    dp.add_handler(CommandHandler("quote", timed('quote', quote)))
+    dp.add_handler(CommandHandler("sticker", timed('sticker', sticker)))
+    dp.add_handler(CommandHandler("topweekly", timed('top_weekly', top_weekly)))
+    dp.add_handler(CommandHandler("topmonthly", timed('top_monthly', top_monthly)))
+    dp.add_handler(CommandHandler("top", timed('top_window', top_window)))
+    dp.add_handler(CommandHandler("export", timed('export', export)))
+    dp.add_handler(CallbackQueryHandler(timed('leaderboard_page', leaderboard_page), pattern=r'^lb:'))
+    
+    # Handle new members
+    dp.add_handler(MessageHandler(Filters.status_update.new_chat_members, timed('new_member', new_member)))
+    dp.add_handler(MessageHandler(Filters.status_update.left_chat_member,
+                                  timed('left_chat_member', left_chat_member)))
+    
+    # Track all messages for activity
+    dp.add_handler(MessageHandler(
+        Filters.text & ~Filters.command,
+        timed('track_activity', track_activity)
+    ))
+    
+    # Log all errors
+    dp.add_error_handler(error_handler)
+
+def start_services(bot):
+    """Open the stores and start the outbox; call before any update is dispatched."""
+    # Open the activity store before any update can reach track_activity
+    with profiler.phase('open activity store'):
+        activity.open()
+        if update_log:
+            update_log.start(activity)
+    
+    with profiler.phase('start outbox'):
+        outbox.start(bot)
+
+def stop_services(bot, timeout=0.0):
+    """Greet pending joins, send what the outbox can within ``timeout`` seconds and persist all state."""
+    joins.flush_all(bot)
+    exporter.stop()
+    # An answer that is late by now is of no use to anyone
+    callback_answers.shutdown(wait=False, cancel_futures=True)
+    outbox.stop(timeout)
+    logger.info(f"Outbox stats at shutdown: {outbox.stats()}")
+    rotations.save()
+    seen_updates.save()
+    if update_log:
+        update_log.close()
+    activity.close()
+
+def schedule_jobs(job_queue):
+    """Add the recurring jobs once updates are already flowing (the first one costs ~100 ms)."""
+    # Sticker file_ids and joke/quote rotations are loaded off the startup path:
+    # the catalogue from the job queue, the rotations on the first draw.
+    with profiler.phase('schedule jobs'):
+        stickers.schedule(job_queue)
+        job_queue.run_repeating(lambda context: rotations.save(), 60, name='rotation-save')
+        job_queue.run_repeating(lambda context: seen_updates.save(), 10, name='seen-updates-save')
+        digests.start(job_queue)
+
+def start_metrics(port, outbox_gauges=True):
+    """Serve Prometheus text at http://METRICS_HOST:port/metrics; returns None if port is empty."""
+    if not port:
+        return None
+    with profiler.phase('start metrics'):
+        if outbox_gauges:
+            registry.gauge('bot_outbox_depth', 'Queued outbound requests',
+                           lambda: {(name,): n for name, n in outbox.stats()['depth_by_priority'].items()},
+                           ['priority'])
+            registry.gauge('bot_outbox_requests', 'Outbound requests by outcome since start',
+                           lambda: {(outcome,): n for outcome, n in outbox.stats().items()
+                                    if outcome in ('sent', 'failed', 'dropped', 'merged', 'retried',
+                                                   'short_circuited')},
+                           ['outcome'])
+        registry.gauge('bot_duplicate_updates', 'Already processed updates dropped since start, by match',
+                       lambda: {(match,): n for match, n in seen_updates.duplicates.items()},
+                       ['match'])
+        registry.gauge('bot_flood_dropped', 'Messages and commands dropped by the flood limits since start',
+                       lambda: {('user',): user_flood.dropped, ('chat_commands',): chat_commands.dropped},
+                       ['limit'])
+        registry.gauge('bot_flood_throttled', 'Senders and chats currently over their flood limit',
+                       lambda: {('user',): len(user_flood.throttled(time.time())),
+                                ('chat_commands',): len(chat_commands.throttled(time.time()))},
+                       ['limit'])
+        metrics_server = MetricsServer(registry, os.getenv('METRICS_HOST', '127.0.0.1'), int(port))
+        metrics_server.start()
+    return metrics_server
+
+def requeue_unprocessed(dp):
+    """Queue the updates the last shutdown received but didn't get to, ahead of any new ones."""
+    unprocessed = seen_updates.take_unprocessed()
+    for data in unprocessed:
+        dp.update_queue.put(Update.de_json(data, dp.bot))
+    if unprocessed:
+        logger.info(f"Queued {len(unprocessed)} updates left unprocessed at the last shutdown")
+
+def start_ingest(updater):
+    """Start receiving updates by webhook or long polling, per BOT_MODE; returns the webhook server if any."""
+    requeue_unprocessed(updater.dispatcher)
+    webhook_server = None
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        logger.info("Starting bot in webhook mode...")
+        with profiler.phase('start webhook'):
+            from webhook import start_webhook
+            webhook_server = start_webhook(
+                updater,
+                os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL'),
+                secret_token=os.getenv('WEBHOOK_SECRET') or None,
+                port=int(os.getenv('PORT', '8443')),
+                path=os.getenv('WEBHOOK_PATH', '/telegram'),
+                max_body=int(os.getenv('WEBHOOK_MAX_BODY', str(1024 * 1024)))
+            )
+    else:
+        logger.info("Starting bot...")
+        with profiler.phase('start polling'):
+            # Resume after the last update the previous run processed rather than re-reading its backlog
+            updater.last_update_id = seen_updates.resume_offset(
+                float(os.getenv('POLLING_OFFSET_MAX_AGE', '86400')))
+            updater.start_polling()
+    profiler.ready()
+    return webhook_server
+
+def wait_for_stop_signal():
+    """Block until SIGINT, SIGTERM or SIGABRT; a second signal exits immediately."""
+    stopping = threading.Event()
+    
+    def handler(signum, frame):
+        if stopping.is_set():
+            logger.warning("Exiting immediately")
+            os._exit(1)
+        logger.info(f"Received {signal.Signals(signum).name}, shutting down")
+        stopping.set()
+    
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(signum, handler)
+    while not stopping.wait(1):
+        pass
+
+def stop_dispatcher(dp, deadline):
+    """Let ``dp`` process its queued updates until ``deadline``, then stop it; returns the updates left over."""
+    while not dp.update_queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    left = []
+    while True:
+        try:
+            left.append(dp.update_queue.get_nowait())
+        except Empty:
+            break
+    dp.stop()
+    return [update for update in left if isinstance(update, Update)]
+
+def stop_ingest(updater, webhook_server, deadline):
+    """Stop receiving updates, process the received ones until ``deadline`` and stop the dispatcher.
+    
+    Updates still queued at the deadline were already confirmed to Telegram
+    (by the next getUpdates, or the webhook's 200), so they are kept with the
+    seen ids to be processed after the restart. Returns the getUpdates offset
+    to resume polling from.
+    """
+    # The polling thread ignores whatever its current request still returns; the webhook stops accepting
+    updater.running = False
+    if webhook_server:
+        webhook_server.stop()
+    
+    left = stop_dispatcher(updater.dispatcher, deadline)
+    updater.job_queue.stop()
+    
+    seen_updates.set_unprocessed(left)
+    if left:
+        logger.warning(f"Saving {len(left)} received updates to process after the restart")
+    return updater.last_update_id
+
+def run_shard(shard, shards, updates):
+    """Handle the updates routed to one shard until told to stop; runs in a worker process."""
+    # The ingest process coordinates shutdown, so Ctrl-C on the process group is left to it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    
+    # State that is saved whole gets a file per shard; the activity database is shared
+    rotations.path = shard_path(rotations.path, shard)
+    seen_updates.path = shard_path(seen_updates.path, shard)
+    digests.owns = lambda chat_id: shard_of(chat_id, shards) == shard
+    if update_log:
+        update_log.path = shard_path(update_log.path, shard)
+    # The Bot API's global rate limit is split between the shards
+    rate = outbox.global_bucket.rate / shards
+    outbox.global_bucket = TokenBucket(rate, rate)
+    
+    bot = create_bot(token)
+    job_queue = create_job_queue()
+    dp = Dispatcher(
+        bot,
+        Queue(),
+        workers=RUN_ASYNC_WORKERS,
+        job_queue=job_queue,
+        persistence=create_persistence(shard),
+        use_context=True
+    )
+    job_queue.set_dispatcher(dp)
+    register_handlers(dp)
+    start_services(bot)
+    metrics_port = os.getenv('METRICS_PORT', '9464')
+    metrics_server = start_metrics(metrics_port and int(metrics_port) + 1 + shard)
+    
+    ready = threading.Event()
+    threading.Thread(target=dp.start, kwargs={'ready': ready}, name=f'dispatcher-{shard}', daemon=True).start()
+    ready.wait()
+    job_queue.start()
+    schedule_jobs(job_queue)
+    requeue_unprocessed(dp)
+    logger.info(f"Shard {shard}/{shards} ready")
+    
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        try:
+            dp.update_queue.put(Update.de_json(json.loads(data), bot))
+        except Exception as e:
+            logger.error(f"Couldn't decode routed update: {e}")
+    
+    # The dispatcher works through its queue within SHUTDOWN_TIMEOUT; pending sends get what is left of it
+    deadline = time.monotonic() + float(os.getenv('SHUTDOWN_TIMEOUT', '20'))
+    left = stop_dispatcher(dp, deadline)
+    seen_updates.set_unprocessed(left)
+    if left:
+        logger.warning(f"Shard {shard} saving {len(left)} routed updates to process after the restart")
+    job_queue.stop()
+    dp.update_persistence()
+    dp.persistence.flush()
+    if metrics_server:
+        metrics_server.stop()
+    stop_services(bot, max(0.0, deadline - time.monotonic()))
+
 def main():
     """Start the bot."""
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token or token == 'your_bot_token_here':
+        logger.error('No valid bot token found in .env file')
+        sys.exit(1)
+    
+    shards = int(os.getenv('SHARDS', '1'))
     try:
-        # Create the Updater with persistence
-        persistence = PicklePersistence(filename='bot_data')
-        updater = Updater(TOKEN, use_context=True, persistence=persistence)
-        dp = updater.dispatcher
-        
-        # Add command handlers
-        dp.add_handler(CommandHandler("start", start))
-        dp.add_handler(CommandHandler("joke", joke))
-        dp.add_handler(CommandHandler("quote", quote))
-        dp.add_handler(CommandHandler("sticker", sticker))
-        dp.add_handler(CommandHandler("topweekly", top_weekly))
-        dp.add_handler(CommandHandler("topmonthly", top_monthly))
+        if shards > 1:
+            run_sharded(token, shards)
+            return
         
-        # Handle new members
-        dp.add_handler(MessageHandler(Filters.status_update.new_chat_members, new_member))
-        dp.add_handler(MessageHandler(Filters.status_update.left_chat_member, left_chat_member))
+        # Create the Updater with persistence
+        with profiler.phase('create updater'):
+            updater = Updater(
+                bot=create_bot(token),
+                use_context=True,
+                persistence=create_persistence(),
+                workers=RUN_ASYNC_WORKERS
+            )
+            create_job_queue(updater.job_queue)
         
-        # Track all messages for activity
-        dp.add_handler(MessageHandler(
-            Filters.text & ~Filters.command,
-            track_activity
-        ))
+        with profiler.phase('register handlers'):
+            register_handlers(updater.dispatcher)
         
-        # Log all errors
-        dp.add_error_handler(error_handler)
+        start_services(updater.bot)
+        metrics_server = start_metrics(os.getenv('METRICS_PORT', '9464'))
         
         # Start the Bot
-        logger.info("Starting bot...")
-        updater.start_polling()
+        webhook_server = start_ingest(updater)
+        schedule_jobs(updater.job_queue)
         
-        # Run the bot until you press Ctrl-C
-        updater.idle()
+        # Run the bot until you press Ctrl-C or the platform sends SIGTERM
+        wait_for_stop_signal()
+        
+        # Drain within SHUTDOWN_TIMEOUT: finish received updates, then pending sends, then persist
+        deadline = time.monotonic() + float(os.getenv('SHUTDOWN_TIMEOUT', '20'))
+        offset = stop_ingest(updater, webhook_server, deadline)
+        if not webhook_server:
+            seen_updates.set_offset(offset)
+        updater.dispatcher.update_persistence()
+        updater.persistence.flush()
+        if metrics_server:
+            metrics_server.stop()
+        stop_services(updater.bot, max(0.0, deadline - time.monotonic()))
+        # Whatever the long poll still returns is ignored; its thread ends within the poll timeout
+        logger.info("Shutdown complete")
         
     except Exception as e:
         logger.error(f"Bot stopped with error: {e}")
         raise
 
+def run_sharded(token, shards):
+    """Receive updates in this process and hand each chat's updates to one of ``shards`` workers."""
+    router = ShardRouter(run_shard, shards, max_queue=int(os.getenv('SHARD_QUEUE_SIZE', '10000')))
+    router.start()
+    
+    updater = Updater(bot=create_bot(token), use_context=True, workers=RUN_ASYNC_WORKERS)
+    updater.dispatcher.add_handler(TypeHandler(Update, router.route))
+    metrics_server = start_metrics(os.getenv('METRICS_PORT', '9464'), outbox_gauges=False)
+    webhook_server = start_ingest(updater)
+    updater.job_queue.run_repeating(router.check, 5, name='shard-check')
+    
+    wait_for_stop_signal()
+    
+    # Workers finish their queues, send what they can and persist within SHUTDOWN_TIMEOUT
+    timeout = float(os.getenv('SHUTDOWN_TIMEOUT', '20'))
+    offset = stop_ingest(updater, webhook_server, time.monotonic() + timeout)
+    if not webhook_server:
+        seen_updates.set_offset(offset)
+    seen_updates.save()
+    if metrics_server:
+        metrics_server.stop()
+    router.stop(timeout + 10)
+    logger.info(f"Updates routed per shard: {router.routed}")
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,88 @@
+"""Small thread-safe caches for Bot API lookups."""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire ``ttl`` seconds after being set."""
+
+    def __init__(self, maxsize=10000, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, key, fn):
+        """Replace a live entry with ``fn(value)``, keeping its expiry; missing keys are left alone."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[1] <= time.monotonic():
+                return
+            self._data[key] = (fn(entry[0]), entry[1])
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[0]
+
+
+class MemberCountCache:
+    """Per-chat member counts, fetched once and then kept current from join/leave events.
+
+    The count is re-read from the API once ``ttl`` seconds have passed, which
+    corrects any drift from events the bot did not see.
+    """
+
+    def __init__(self, ttl=900.0, maxsize=10000):
+        self._cache = TTLCache(maxsize, ttl)
+
+    def get(self, bot, chat_id):
+        count = self._cache.get(chat_id)
+        if count is None:
+            count = bot.get_chat_member_count(chat_id)
+            self._cache.set(chat_id, count)
+        return count
+
+    def adjust(self, chat_id, delta):
+        """Apply a local join (+) or leave (-) to a cached count."""
+        self._cache.update(chat_id, lambda count: max(0, count + delta))
+
+
+class ProfilePhotoCache:
+    """Remembers whether users have a profile photo."""
+
+    def __init__(self, ttl=86400.0, maxsize=50000):
+        self._cache = TTLCache(maxsize, ttl)
+
+    def has_photo(self, bot, user_id):
+        has_photo = self._cache.get(user_id)
+        if has_photo is None:
+            photos = bot.get_user_profile_photos(user_id, limit=1)
+            has_photo = bool(photos.photos)
+            self._cache.set(user_id, has_photo)
+        return has_photo
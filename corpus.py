@@ -0,0 +1,110 @@
+"""Memory-mapped, offset-indexed text corpora.
+
+A corpus file is a packed UTF-8 blob with an offset index in front of it::
+
+    magic   8 bytes   b'WBCORP1\\0'
+    count   uint32    number of records
+    offsets uint32 x (count + 1), relative to the start of the blob
+    blob    UTF-8 records back to back
+
+Records with several fields (a quote and its author) keep them separated
+by ``FIELD_SEPARATOR``. Only the index entries and bytes of the records that
+are actually read are touched, so a corpus of any size costs almost nothing
+to open.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b'WBCORP1\0'
+HEADER = struct.Struct('<8sI')
+OFFSET = struct.Struct('<I')
+FIELD_SEPARATOR = '\x1f'
+
+
+def read_source(path):
+    """Load records from a .json list (of strings or field lists) or a .txt file with one per line."""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.json'):
+            records = json.load(f)
+        else:
+            records = [line.rstrip('\n') for line in f if line.strip()]
+    return [record if isinstance(record, str) else FIELD_SEPARATOR.join(record) for record in records]
+
+
+def build(records, path):
+    """Write ``records`` (strings) as a corpus file at ``path``."""
+    blobs = [record.encode('utf-8') for record in records]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(blobs)))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, path)
+
+
+def ensure_built(source, path):
+    """Rebuild ``path`` from ``source`` if it is missing or older than the source."""
+    if not os.path.exists(source):
+        return False
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source):
+        return False
+    build(read_source(source), path)
+    return True
+
+
+class Corpus:
+    """Read-only, memory-mapped view of a corpus file, opened on first use."""
+
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = source
+        self._mm = None
+        self._count = 0
+        self._blob = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        with self._lock:
+            if self._mm is not None:
+                return
+            if self.source:
+                ensure_built(self.source, self.path)
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                mm.close()
+                raise ValueError(f"{self.path} is not a corpus file")
+            self._count = count
+            self._blob = HEADER.size + OFFSET.size * (count + 1)
+            self._mm = mm
+
+    def __len__(self):
+        if self._mm is None:
+            self._open()
+        return self._count
+
+    def __getitem__(self, index):
+        if self._mm is None:
+            self._open()
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        start, end = struct.unpack_from('<2I', self._mm, HEADER.size + OFFSET.size * index)
+        return self._mm[self._blob + start:self._blob + end].decode('utf-8')
+
+    def fields(self, index):
+        """Return a record split into its fields."""
+        return tuple(self[index].split(FIELD_SEPARATOR))
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
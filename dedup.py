@@ -0,0 +1,143 @@
+"""Dropping of updates that were already processed, e.g. redelivered after a restart."""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from telegram.ext import DispatcherHandlerStop
+
+logger = logging.getLogger(__name__)
+
+
+class SeenUpdates:
+    """Bounded record of processed updates, saved to ``path`` as JSON.
+
+    Remembers the last ``maxsize`` update ids and the last ``maxsize``
+    ``(chat_id, message_id)`` pairs of new messages, least recently seen
+    evicted first. The message key catches a redelivered message that comes
+    back under a different update id, as happens after switching between
+    polling and a webhook. Register ``check`` as a dispatcher callback in a
+    negative group, ahead of every handler that has side effects.
+
+    The file also holds what the last shutdown left behind: the getUpdates
+    offset to resume polling from, and the updates that had been received
+    but not processed by the deadline. Telegram considers those delivered
+    and never sends them again, so they are kept here to be queued first on
+    the next start.
+    """
+
+    def __init__(self, path='seen_updates.json', maxsize=10000):
+        self.path = path
+        self.maxsize = maxsize
+        self.duplicates = {'update_id': 0, 'message': 0}
+        self.offset = None
+        self.offset_time = None
+        self.unprocessed = []
+        self._updates = OrderedDict()
+        self._messages = OrderedDict()
+        self._dirty = False
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def check(self, update, context):
+        """Dispatcher callback that stops a duplicate update from reaching later groups."""
+        if self.seen(update):
+            logger.info("Dropping duplicate update %s", update.update_id, extra={'event': 'duplicate'})
+            raise DispatcherHandlerStop()
+
+    def seen(self, update):
+        """Whether ``update`` was seen before; remembers it either way."""
+        if not self._loaded:
+            self.load()
+        # Edits and button presses reuse the message_id of the message they belong to
+        message = update.message or update.channel_post
+        key = (message.chat_id, message.message_id) if message else None
+        with self._lock:
+            if update.update_id in self._updates:
+                self.duplicates['update_id'] += 1
+                duplicate = True
+            elif key is not None and key in self._messages:
+                self.duplicates['message'] += 1
+                duplicate = True
+            else:
+                duplicate = False
+            self._remember(self._updates, update.update_id)
+            if key is not None:
+                self._remember(self._messages, key)
+            self._dirty = True
+        return duplicate
+
+    def set_offset(self, offset):
+        """Record the getUpdates offset to resume polling from; saved with the ids."""
+        with self._lock:
+            self.offset = offset
+            self.offset_time = time.time()
+            self._dirty = True
+
+    def set_unprocessed(self, updates):
+        """Record received updates that weren't processed, to be handed out by ``take_unprocessed``."""
+        with self._lock:
+            self.unprocessed = [update.to_dict() for update in updates]
+            self._dirty = True
+
+    def take_unprocessed(self):
+        """Update data recorded at the last shutdown, forgetting it."""
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            unprocessed, self.unprocessed = self.unprocessed, []
+            if unprocessed:
+                self._dirty = True
+        return unprocessed
+
+    def resume_offset(self, max_age):
+        """The saved offset, or 0 (start from what Telegram hasn't confirmed) if it is older than ``max_age``."""
+        if not self._loaded:
+            self.load()
+        if self.offset is None or time.time() - self.offset_time > max_age:
+            return 0
+        return self.offset
+
+    def _remember(self, seen, key):
+        seen[key] = None
+        seen.move_to_end(key)
+        if len(seen) > self.maxsize:
+            seen.popitem(last=False)
+
+    def load(self):
+        """Restore the saved ids; called on the first update if not called before."""
+        self._loaded = True
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable seen updates {self.path}: {e}")
+            return
+        with self._lock:
+            if saved.get('offset') is not None:
+                self.offset, self.offset_time = saved['offset'], saved['offset_time']
+            self.unprocessed = saved.get('unprocessed', [])
+            for update_id in saved.get('updates', [])[-self.maxsize:]:
+                self._remember(self._updates, update_id)
+            for chat_id, message_id in saved.get('messages', [])[-self.maxsize:]:
+                self._remember(self._messages, (chat_id, message_id))
+
+    def save(self):
+        """Write the ids out, oldest first, if any update was seen since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            saved = {'updates': list(self._updates), 'messages': [list(key) for key in self._messages],
+                     'offset': self.offset, 'offset_time': self.offset_time, 'unprocessed': self.unprocessed}
+            self._dirty = False
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Couldn't save seen updates: {e}")
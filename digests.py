@@ -0,0 +1,135 @@
+"""Weekly and monthly leaderboard digests posted to every active group from the JobQueue."""
+import logging
+import random
+from datetime import date, datetime, time, timedelta
+
+from leaderboard import Snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def window(kind, end):
+    """``(kind, first, last, title)`` of the ``kind`` window that ends the day before ``end``."""
+    last = end - timedelta(days=1)
+    if kind == 'weekly':
+        first = end - timedelta(days=7)
+        return kind, first, last, f"Top Active Members (Week of {first.day} {first:%b})"
+    return kind, last.replace(day=1), last, f"Top Active Members ({last:%B %Y})"
+
+
+def closed_windows(today, kinds):
+    """``(kind, first, last, title)`` of each window in ``kinds`` that ended yesterday."""
+    windows = []
+    if 'weekly' in kinds and today.weekday() == 0:
+        windows.append(window('weekly', today))
+    if 'monthly' in kinds and today.day == 1:
+        windows.append(window('monthly', today))
+    return windows
+
+
+def latest_windows(today, kinds):
+    """``(kind, first, last, title)`` of the most recent window in ``kinds`` that has ended by ``today``."""
+    ends = {'weekly': today - timedelta(days=today.weekday()), 'monthly': today.replace(day=1)}
+    return [window(kind, ends[kind]) for kind in ('weekly', 'monthly') if kind in kinds]
+
+
+class Digests:
+    """Post the leaderboard of each week and month that just ended to every group with activity in it.
+
+    Just after local midnight on Mondays and on the 1st, the window that
+    closed is ranked from the stored daily counts, which are final by then,
+    and frozen into one ``Snapshot`` per chat; nothing on the update path is
+    read. The posts are then spread over ``spread`` seconds, one chat per
+    slot at a random point inside it, so hundreds of groups don't hit the
+    global rate limit at once. ``post(chat_id, snapshot)`` sends one digest
+    and returns the Future of the send; ``owns(chat_id)`` picks the chats
+    this process posts to.
+
+    Each sent digest is recorded in the activity database. On start, the
+    latest window of each kind that ended within ``catch_up`` seconds is
+    posted to the chats that haven't had it, so a restart around midnight
+    or during the spread loses nothing.
+    """
+
+    def __init__(self, activity, post, kinds=('weekly', 'monthly'), spread=3600.0, size=50, owns=None,
+                 catch_up=2 * 86400.0):
+        self.activity = activity
+        self.post = post
+        self.kinds = kinds
+        self.spread = spread
+        self.size = size
+        self.owns = owns
+        self.catch_up = catch_up
+
+    def start(self, job_queue):
+        """Catch up on digests a restart left unposted, then post every new one."""
+        if not self.kinds:
+            return
+        job_queue.run_once(self._on_start, 0, name='digests-catch-up')
+        self.schedule(job_queue)
+
+    def schedule(self, job_queue):
+        """Run at the next local midnight, and from there at every one after it."""
+        if not self.kinds:
+            return
+        # Day ordinals in the activity store are local dates, so the boundary is local midnight;
+        # it is worked out again every day rather than repeated every 24h, which DST would shift
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), time())
+        job_queue.run_once(self._on_midnight, (midnight - now).total_seconds() + 1, name='digests')
+
+    def _on_start(self, context):
+        now = datetime.now()
+        windows = [
+            (kind, first, last, title) for kind, first, last, title in latest_windows(now.date(), self.kinds)
+            if (now - datetime.combine(last + timedelta(days=1), time())).total_seconds() <= self.catch_up
+        ]
+        self.run(windows, context.job_queue)
+
+    def _on_midnight(self, context):
+        self.schedule(context.job_queue)
+        self.run(closed_windows(date.today(), self.kinds), context.job_queue)
+
+    def run(self, windows, job_queue):
+        """Freeze ``windows`` for the chats that haven't had them and schedule their posts."""
+        for kind, first, last, title in windows:
+            try:
+                snapshots = self.freeze(kind, first, last, title)
+            except Exception as e:
+                logger.error(f"Couldn't build the {kind} digests: {e}")
+                continue
+            chats = list(snapshots)
+            random.shuffle(chats)
+            slot = self.spread / len(chats) if chats else 0
+            for index, chat_id in enumerate(chats):
+                job_queue.run_once(self._on_post, (index + random.random()) * slot,
+                                   context=(kind, first, chat_id, snapshots[chat_id]), name=f"digest:{chat_id}")
+            logger.info(f"Scheduled {len(chats)} {kind} digests over {self.spread:.0f}s")
+
+    def freeze(self, kind, first, last, title):
+        """One snapshot per owned group with activity between ``first`` and ``last`` that hasn't had it yet."""
+        posted = self.activity.digests_posted(kind, first.toordinal())
+        ranked = self.activity.window_totals(first.toordinal(), last.toordinal(), self.size, self._wanted)
+        return {chat_id: Snapshot(title, rows) for chat_id, rows in ranked.items() if chat_id not in posted}
+
+    def _wanted(self, chat_id):
+        # Only groups; private chats with the bot get no digest
+        return chat_id < 0 and (self.owns is None or self.owns(chat_id))
+
+    def _on_post(self, context):
+        kind, first, chat_id, snapshot = context.job.context
+        try:
+            sent = self.post(chat_id, snapshot)
+        except Exception as e:
+            logger.error(f"Couldn't post digest to chat {chat_id}: {e}")
+            return
+
+        def done(future):
+            if future.exception() is not None:
+                logger.error(f"Couldn't post digest to chat {chat_id}: {future.exception()}")
+                return
+            try:
+                self.activity.mark_digest_posted(chat_id, kind, first.toordinal())
+            except Exception as e:
+                logger.error(f"Couldn't record digest posted to chat {chat_id}: {e}")
+        sent.add_done_callback(done)
@@ -0,0 +1,148 @@
+"""CSV exports of a chat's activity, streamed from SQLite to a file on a worker thread."""
+import csv
+import gzip
+import io
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+MEMBER_COLUMNS = ('user_id', 'username', 'full_name', 'messages', 'last_active', 'last_7_days', 'last_30_days')
+
+# One row per member, most active first, with the window totals behind the leaderboards
+MEMBER_ROWS = """
+SELECT m.user_id, m.username, m.full_name, m.messages, m.last_active,
+       COALESCE(d.week, 0), COALESCE(d.month, 0)
+FROM members m
+LEFT JOIN (
+    SELECT user_id, SUM(CASE WHEN day > ? THEN messages ELSE 0 END) AS week, SUM(messages) AS month
+    FROM daily_counts
+    WHERE chat_id = ? AND day > ?
+    GROUP BY user_id
+) d ON d.user_id = m.user_id
+WHERE m.chat_id = ?
+ORDER BY m.messages DESC, m.user_id
+"""
+
+DAILY_COLUMNS = ('date', 'user_id', 'messages')
+
+# The stored daily counts, which go back about a month
+DAILY_ROWS = "SELECT day, user_id, messages FROM daily_counts WHERE chat_id = ? ORDER BY day, user_id"
+
+
+def text_cell(value):
+    """``value`` as a cell spreadsheets show as text, never evaluate as a formula."""
+    if value and value[0] in '=+-@\t\r':
+        return "'" + value
+    return value
+
+
+def member_rows(cursor):
+    for user_id, username, full_name, messages, last_active, week, month in cursor:
+        if last_active is not None:
+            last_active = datetime.fromtimestamp(last_active).isoformat(timespec='seconds')
+        # Names are chosen by the members themselves
+        yield user_id, text_cell(username), text_cell(full_name), messages, last_active, week, month
+
+
+def daily_rows(cursor):
+    for day, user_id, messages in cursor:
+        yield date.fromordinal(day).isoformat(), user_id, messages
+
+
+class Exporter:
+    """Write a chat's activity as CSV (optionally gzipped) to a temporary file, off the dispatcher.
+
+    Rows are read from the activity database through a connection of the
+    export's own, ``chunk_rows`` at a time, and the CSV text goes to the file
+    in chunks of about ``chunk_bytes``, so memory stays flat however large
+    the chat is. Exports run on ``workers`` threads; a chat has at most one
+    export queued or running at a time.
+    """
+
+    def __init__(self, path, workers=1, chunk_rows=1000, chunk_bytes=64 * 1024):
+        self.path = path
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.chunk_bytes = chunk_bytes
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='export')
+        self._chats = set()
+        self._lock = threading.Lock()
+
+    def submit(self, chat_id, job):
+        """Run ``job()`` on an export thread; returns False if ``chat_id`` already has an export going."""
+        with self._lock:
+            if chat_id in self._chats:
+                return False
+            self._chats.add(chat_id)
+
+        def run():
+            try:
+                job()
+            except Exception as e:
+                logger.error(f"Export for chat {chat_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self._chats.discard(chat_id)
+
+        self._executor.submit(run)
+        return True
+
+    def write(self, chat_id, daily=False, compress=False):
+        """Export ``chat_id`` to a new temporary file; returns its path and the number of rows.
+
+        The caller removes the file.
+        """
+        fd, path = tempfile.mkstemp(prefix=f"export-{chat_id}-", suffix='.csv.gz' if compress else '.csv')
+        conn = sqlite3.connect(self.path)
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                out = gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) if compress else raw
+                try:
+                    if daily:
+                        cursor = conn.execute(DAILY_ROWS, (chat_id,))
+                        rows = self._write_csv(DAILY_COLUMNS, daily_rows(self._fetch(cursor)), out)
+                    else:
+                        today = date.today().toordinal()
+                        cursor = conn.execute(MEMBER_ROWS, (today - 7, chat_id, today - 30, chat_id))
+                        rows = self._write_csv(MEMBER_COLUMNS, member_rows(self._fetch(cursor)), out)
+                finally:
+                    if compress:
+                        out.close()
+        except BaseException:
+            os.unlink(path)
+            raise
+        finally:
+            conn.close()
+        return path, rows
+
+    def stop(self):
+        """Drop exports that haven't started; one already running finishes on its own."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetch(self, cursor):
+        while True:
+            batch = cursor.fetchmany(self.chunk_rows)
+            if not batch:
+                return
+            yield from batch
+
+    def _write_csv(self, columns, rows, out):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if buffer.tell() >= self.chunk_bytes:
+                out.write(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+        out.write(buffer.getvalue().encode('utf-8'))
+        return count
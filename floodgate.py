@@ -0,0 +1,91 @@
+"""Sliding-window rate limits that keep message floods out of the stats and away from the Bot API."""
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Window:
+    """Hit counts of one key in the current and the previous fixed window."""
+
+    __slots__ = ('index', 'current', 'previous', 'dropped')
+
+    def __init__(self, index):
+        self.index = index
+        self.current = 0
+        self.previous = 0
+        self.dropped = 0
+
+
+class SlidingWindow:
+    """Per-key hit rate over the last ``window`` seconds, in constant time and memory per key.
+
+    Each key keeps the counts of the current and the previous aligned window;
+    its rate is the current count plus the previous one weighted by how much
+    of it the sliding window still covers. A hit that takes a key over
+    ``limit`` is refused, and refused hits still count, so a key stays
+    throttled until it slows down. At most ``maxsize`` keys are tracked, the
+    least recently hit evicted first. A ``limit`` of 0 turns the limit off.
+    """
+
+    def __init__(self, limit, window=10.0, maxsize=100000, name='key'):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self.name = name
+        self.dropped = 0
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, now):
+        """Count a hit for ``key`` at ``now`` (Unix time); returns False if it is over the limit."""
+        if self.limit <= 0:
+            return True
+        index, offset = divmod(now, self.window)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = Window(index)
+                if len(self._windows) > self.maxsize:
+                    self._windows.popitem(last=False)
+            else:
+                self._windows.move_to_end(key)
+                if index > window.index:
+                    window.previous = window.current if index == window.index + 1 else 0
+                    window.current = 0
+                    window.index = index
+            window.current += 1
+            rate = window.current + window.previous * (1 - offset / self.window)
+            allowed = rate <= self.limit
+            started = not allowed and not window.dropped
+            ended = allowed and window.dropped
+            if allowed:
+                dropped, window.dropped = window.dropped, 0
+            else:
+                window.dropped += 1
+                self.dropped += 1
+
+        if started:
+            logger.warning("Throttling %s %s at %.0f per %gs", self.name, key, rate, self.window,
+                           extra={'event': 'throttle', self.name: key})
+        elif ended:
+            logger.info("Stopped throttling %s %s after dropping %d", self.name, key, dropped,
+                        extra={'event': 'throttle', self.name: key, 'dropped': dropped})
+        return allowed
+
+    def throttled(self, now):
+        """Keys over the limit as of ``now``, with their rate, highest first."""
+        index, offset = divmod(now, self.window)
+        over = []
+        with self._lock:
+            for key, window in self._windows.items():
+                if index == window.index:
+                    rate = window.current + window.previous * (1 - offset / self.window)
+                elif index == window.index + 1:
+                    rate = window.current * (1 - offset / self.window)
+                else:
+                    continue
+                if rate > self.limit:
+                    over.append((key, rate))
+        return sorted(over, key=lambda item: -item[1])
@@ -0,0 +1,188 @@
+"""Append-only journal persistence for the dispatcher's user, chat and bot data."""
+import logging
+import os
+import pickle
+import struct
+import threading
+import zlib
+from collections import defaultdict
+from copy import deepcopy
+
+from telegram.ext import BasePersistence
+
+logger = logging.getLogger(__name__)
+
+# Every journal record is framed as (payload length, CRC-32 of payload) + payload
+FRAME = struct.Struct('<II')
+
+TABLES = {'user': 'user_data', 'chat': 'chat_data'}
+
+
+class JournalPersistence(BasePersistence):
+    """``BasePersistence`` that appends changes to a journal instead of rewriting all state.
+
+    Each changed user, chat or bot data entry and each conversation state
+    change is appended to ``<path>.journal`` as one framed pickle record, so a
+    write costs in proportion to what changed. Unchanged entries (the
+    dispatcher re-submits every chat and user it sees) aren't written at all.
+    After ``compact_every`` records, and on flush, the whole state is written
+    to ``<path>.snapshot`` and the journal is emptied. Loading reads the
+    snapshot and replays the journal on top of it, dropping a torn record left
+    at the end by a crash. ``legacy_pickle`` names a ``PicklePersistence`` file
+    to import state from when neither file exists yet.
+    """
+
+    def __init__(self, path='bot_state', compact_every=1000, fsync=False, legacy_pickle=None,
+                 store_user_data=True, store_chat_data=True, store_bot_data=True):
+        super().__init__(store_user_data=store_user_data, store_chat_data=store_chat_data,
+                         store_bot_data=store_bot_data)
+        self.path = path
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.legacy_pickle = legacy_pickle
+        self.records = 0
+        self._state = None
+        self._digests = {}
+        self._journal = None
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot_path(self):
+        return f"{self.path}.snapshot"
+
+    @property
+    def journal_path(self):
+        return f"{self.path}.journal"
+
+    def get_user_data(self):
+        with self._lock:
+            self._load()
+            return defaultdict(dict, deepcopy(self._state['user_data']))
+
+    def get_chat_data(self):
+        with self._lock:
+            self._load()
+            return defaultdict(dict, deepcopy(self._state['chat_data']))
+
+    def get_bot_data(self):
+        with self._lock:
+            self._load()
+            return deepcopy(self._state['bot_data'])
+
+    def get_callback_data(self):
+        return None
+
+    def get_conversations(self, name):
+        with self._lock:
+            self._load()
+            return dict(self._state['conversations'].get(name, {}))
+
+    def update_user_data(self, user_id, data):
+        self._write('user', user_id, data)
+
+    def update_chat_data(self, chat_id, data):
+        self._write('chat', chat_id, data)
+
+    def update_bot_data(self, data):
+        self._write('bot', None, data)
+
+    def update_callback_data(self, data):
+        pass
+
+    def update_conversation(self, name, key, new_state):
+        self._write('conversation', (name, key), new_state)
+
+    def flush(self):
+        """Fold the journal into a fresh snapshot; called by the Updater on shutdown."""
+        with self._lock:
+            if self._state is not None and self.records:
+                self._compact()
+
+    def _write(self, kind, key, data):
+        with self._lock:
+            self._load()
+            payload = pickle.dumps((kind, key, data), pickle.HIGHEST_PROTOCOL)
+            digest = hash(payload)
+            previous = self._digests.get((kind, key))
+            if previous == digest or (previous is None and not data):
+                return
+            self._digests[(kind, key)] = digest
+            self._apply(self._state, kind, key, data)
+            self._journal.write(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self.records += 1
+            if self.records >= self.compact_every:
+                self._compact()
+
+    @staticmethod
+    def _apply(state, kind, key, data):
+        if kind == 'bot':
+            state['bot_data'] = data
+        elif kind == 'conversation':
+            name, conversation_key = key
+            states = state['conversations'].setdefault(name, {})
+            if data is None:
+                states.pop(conversation_key, None)
+            else:
+                states[conversation_key] = data
+        else:
+            state[TABLES[kind]][key] = data
+
+    def _load(self):
+        if self._state is not None:
+            return
+        state = {'user_data': {}, 'chat_data': {}, 'bot_data': {}, 'conversations': {}}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                state.update(pickle.load(f))
+        elif (self.legacy_pickle and os.path.exists(self.legacy_pickle)
+              and not os.path.exists(self.journal_path)):
+            with open(self.legacy_pickle, 'rb') as f:
+                legacy = pickle.load(f)
+            for name in state:
+                if legacy.get(name) is not None:
+                    state[name] = legacy[name]
+            logger.info(f"Imported persisted state from {self.legacy_pickle}")
+
+        self._journal = open(self.journal_path, 'a+b')
+        self._journal.seek(0)
+        journal = self._journal.read()
+        offset = 0
+        while offset + FRAME.size <= len(journal):
+            length, checksum = FRAME.unpack_from(journal, offset)
+            payload = journal[offset + FRAME.size:offset + FRAME.size + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            self._apply(state, *pickle.loads(payload))
+            offset += FRAME.size + length
+            self.records += 1
+        if offset < len(journal):
+            logger.warning(f"Dropping {len(journal) - offset} bytes of torn records "
+                           f"at the end of {self.journal_path}")
+            self._journal.truncate(offset)
+        self._journal.seek(0, os.SEEK_END)
+
+        # Digests of what is stored, so unchanged entries aren't written again after a restart
+        entries = [('bot', None, state['bot_data'])]
+        for name, kind in (('user_data', 'user'), ('chat_data', 'chat')):
+            entries.extend((kind, key, data) for key, data in state[name].items())
+        for name, states in state['conversations'].items():
+            entries.extend(('conversation', (name, key), data) for key, data in states.items())
+        for kind, key, data in entries:
+            self._digests[(kind, key)] = hash(pickle.dumps((kind, key, data), pickle.HIGHEST_PROTOCOL))
+        self._state = state
+        logger.info(f"Loaded persisted state from {self.path} ({self.records} journal records replayed)")
+
+    def _compact(self):
+        tmp = f"{self.snapshot_path}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(self._state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        # A crash before this truncate only replays records the snapshot already holds
+        self._journal.truncate(0)
+        self._journal.seek(0)
+        self.records = 0
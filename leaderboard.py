@@ -0,0 +1,151 @@
+"""Incrementally maintained top-N rankings and the snapshots they are shown from."""
+import heapq
+import html
+import math
+import os
+
+from caches import TTLCache
+
+
+def format_rows(title, rows, start=1):
+    """Render ``(count, user_id, full_name, username)`` rows, ranked from ``start``, as HTML."""
+    message = f"🏆 <b>{html.escape(title)}</b> 🏆\n\n"
+    for idx, (count, user_id, full_name, username) in enumerate(rows, start):
+        name = html.escape(full_name or 'Unknown User')
+        handle = html.escape(username or f'user_{user_id}')
+        message += f"{idx}. {name} (@{handle}): {count} messages\n"
+    return message
+
+
+def profile_rows(entries, members):
+    """Attach each member's current name to ranked ``(count, user_id)`` entries."""
+    rows = []
+    for count, user_id in entries:
+        member = members.get(user_id)
+        rows.append((count, user_id, member and member.full_name, member and member.username))
+    return rows
+
+
+class Leaderboard:
+    """The ``size`` highest counters of a window, kept current as counts grow.
+
+    Counters inside a window only ever increase, so a member outside the
+    board can only enter by overtaking the last entry. Each update therefore
+    touches at most ``size`` entries no matter how many members are tracked.
+    """
+
+    def __init__(self, size=10):
+        self.size = size
+        self._top = []
+        self._version = 0
+
+    @classmethod
+    def from_counts(cls, counts, size=10):
+        """Build a board from a ``{user_id: count}`` mapping."""
+        board = cls(size)
+        board._top = [[count, user_id] for user_id, count in
+                      heapq.nlargest(size, counts.items(), key=lambda item: item[1])]
+        return board
+
+    def __len__(self):
+        return len(self._top)
+
+    @property
+    def version(self):
+        """Changes whenever the ranking or a ranked member's profile does."""
+        return self._version
+
+    def entries(self):
+        """Return the current ranking as ``(count, user_id)`` tuples."""
+        return [tuple(entry) for entry in self._top]
+
+    def update(self, user_id, count):
+        """Record that ``user_id`` now has ``count`` messages in this window."""
+        top = self._top
+        for entry in top:
+            if entry[1] == user_id:
+                entry[0] = count
+                break
+        else:
+            if len(top) < self.size:
+                top.append([count, user_id])
+            elif count > top[-1][0]:
+                top[-1] = [count, user_id]
+            else:
+                return
+        top.sort(key=lambda entry: entry[0], reverse=True)
+        self._version += 1
+
+    def touch(self, user_id):
+        """Change the version if ``user_id`` is on the board, e.g. after a profile change."""
+        if any(entry[1] == user_id for entry in self._top):
+            self._version += 1
+
+
+class Snapshot:
+    """A ranking frozen when a leaderboard command ran, rendered a page at a time.
+
+    Rows carry the counts and names as they were then, so paging through a
+    snapshot is consistent and never touches the live counters.
+    """
+
+    def __init__(self, title, rows, page_size=10):
+        self.title = title
+        self.rows = tuple(rows)
+        self.page_size = page_size
+        self._pages = {}
+
+    @property
+    def pages(self):
+        return max(1, math.ceil(len(self.rows) / self.page_size))
+
+    def page(self, number):
+        """HTML text of page ``number`` (from 0)."""
+        text = self._pages.get(number)
+        if text is None:
+            start = number * self.page_size
+            text = format_rows(self.title, self.rows[start:start + self.page_size], start + 1)
+            if self.pages > 1:
+                text += f"\nPage {number + 1} of {self.pages}"
+            self._pages[number] = text
+        return text
+
+
+class SnapshotStore:
+    """Leaderboard snapshots by id, each expiring ``ttl`` seconds after it was last handed out.
+
+    While a board hasn't changed, the chat's latest snapshot of it is handed
+    out again, so a burst of commands costs a single snapshot.
+    """
+
+    def __init__(self, ttl=600.0, maxsize=1000, page_size=10):
+        self.page_size = page_size
+        self._snapshots = TTLCache(maxsize, ttl)
+        self._latest = TTLCache(maxsize, ttl)
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def take(self, chat_id, days, board, members, title):
+        """Return ``(snapshot_id, snapshot)`` for the current state of ``board``."""
+        key = (chat_id, days)
+        latest = self._latest.get(key)
+        if latest is not None and latest[0] is board and latest[1] == board.version:
+            snapshot = self._snapshots.get(latest[2])
+            if snapshot is not None:
+                self._snapshots.set(latest[2], snapshot)
+                return latest[2], snapshot
+        snapshot = Snapshot(title, profile_rows(board.entries(), members), self.page_size)
+        snapshot_id = self.put(snapshot)
+        self._latest.set(key, (board, board.version, snapshot_id))
+        return snapshot_id, snapshot
+
+    def put(self, snapshot):
+        """Store a snapshot built elsewhere and return its id."""
+        # Random ids, so buttons left over from before a restart never match a new snapshot
+        snapshot_id = os.urandom(6).hex()
+        self._snapshots.set(snapshot_id, snapshot)
+        return snapshot_id
+
+    def get(self, snapshot_id):
+        return self._snapshots.get(snapshot_id)
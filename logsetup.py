@@ -0,0 +1,130 @@
+"""Background, sampled, structured logging.
+
+Handlers and threads only put records on an in-memory queue. A
+QueueListener thread formats them (as JSON lines by default) and writes
+them out. Records can be tagged with an event name, e.g.
+``logger.info("Joined: %s", name, extra={'event': 'join'})``. Tagged events
+can be sampled and capped per second before they are queued, so a flood of
+identical events costs little more than the filter check.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# event -> (fraction of records kept, max records per second)
+DEFAULT_EVENTS = {
+    'join': (1.0, 20),
+    'welcome': (1.0, 20),
+    'left': (1.0, 20),
+    'command': (1.0, 50),
+    'flood': (1.0, 5),
+    'retry': (1.0, 10),
+    'duplicate': (1.0, 10),
+    'throttle': (1.0, 10),
+}
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def parse_events(spec):
+    """Parse ``"join:0.1:5,left:1:10"`` into ``{'join': (0.1, 5.0), 'left': (1.0, 10.0)}``."""
+    events = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, rest = item.partition(':')
+        rate, _, cap = rest.partition(':')
+        events[name] = (float(rate or 1), float(cap) if cap else None)
+    return events
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the ``extra`` fields included."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of each tagged event and cap it at a rate per second.
+
+    Errors are never dropped. The number of records dropped since the last one kept is attached to
+    the next kept record of that event as ``suppressed``.
+    """
+
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+        self._windows = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        settings = self.events.get(event)
+        if settings is None or record.levelno >= logging.ERROR:
+            return True
+        rate, cap = settings
+        with self._lock:
+            keep = rate >= 1 or random.random() < rate
+            if keep and cap is not None:
+                second = int(time.monotonic())
+                window, count = self._windows.get(event, (second, 0))
+                if window != second:
+                    window, count = second, 0
+                keep = count < cap
+                self._windows[event] = (window, count + keep)
+            if not keep:
+                self._suppressed[event] = self._suppressed.get(event, 0) + 1
+                return False
+            suppressed = self._suppressed.pop(event, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level='INFO', fmt='json', events=None):
+    """Route all logging through a background writer; returns the started listener."""
+    if fmt == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(SamplingFilter(DEFAULT_EVENTS if events is None else events))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,228 @@
+"""In-process metrics served as Prometheus text.
+
+Counters and histograms are plain dicts of numbers keyed by label values,
+updated under a per-metric lock; an observation is a bisect and a few
+additions, cheap enough to leave on for every update and API call.
+"""
+import bisect
+import logging
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.error import RetryAfter
+from telegram.utils.request import Request
+
+logger = logging.getLogger(__name__)
+
+HANDLER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+API_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = (name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+             for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; each label set holds per-bucket counts, a sum and a count."""
+
+    def __init__(self, name, help, labels=(), buckets=HANDLER_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(bounds, counts):
+                    cumulative += n
+                    le = _labels(self.labels + ('le',), labels + (bound,))
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time; ``read`` returns a number or {label values: number}."""
+
+    def __init__(self, name, help, read, labels=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.read()
+        except Exception as e:
+            logger.warning(f"Couldn't read gauge {self.name}: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=HANDLER_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read, labels=()):
+        return self._add(Gauge(name, help, read, labels))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram('bot_handler_seconds', 'Time spent in update handlers', ['handler'])
+handler_errors = registry.counter('bot_handler_errors_total', 'Exceptions raised by update handlers', ['handler'])
+api_seconds = registry.histogram('bot_api_request_seconds', 'Bot API call latency', ['method'], API_BUCKETS)
+api_errors = registry.counter('bot_api_errors_total', 'Failed Bot API calls', ['method', 'error'])
+api_retry_after = registry.counter('bot_api_retry_after_total', 'Bot API calls refused by flood control (429)',
+                                   ['method'])
+
+
+def timed(name, callback):
+    """Wrap a handler callback to record its latency and exceptions under ``name``."""
+    @wraps(callback)
+    def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+class InstrumentedRequest(Request):
+    """Bot API connection pool that times every call by method name."""
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            return super().post(url, data, timeout)
+        except RetryAfter:
+            api_retry_after.inc(method)
+            raise
+        except Exception as e:
+            api_errors.inc(method, type(e).__name__)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - start, method)
+
+
+class MetricsServer:
+    """Serve ``registry`` at ``/metrics`` from a background thread."""
+
+    def __init__(self, registry=registry, host='127.0.0.1', port=9464):
+        self.registry = registry
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics served on port {self.port}/metrics")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,364 @@
+"""Central outbound send queue with per-chat and global rate limiting."""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from telegram.error import RetryAfter
+
+from resilience import CircuitBreaker, backoff_delay, is_transient
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+PRIORITY_WELCOME = 0
+PRIORITY_STICKER = 1
+PRIORITY_FUN = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_WELCOME: 'welcome',
+    PRIORITY_STICKER: 'sticker',
+    PRIORITY_FUN: 'fun',
+}
+
+
+class QueueFull(Exception):
+    """Raised on a send's future when it was shed because the queue was full."""
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, at most ``capacity`` stored."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        """Refuse tokens for ``seconds``, e.g. after a flood-control error."""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+        self.updated = self.blocked_until
+
+
+class OutboundRequest:
+    """A single pending Bot API call."""
+
+    __slots__ = ('method', 'chat_id', 'kwargs', 'priority', 'merge_key', 'fallback',
+                 'retries', 'attempt', 'future', 'enqueued', 'seq')
+
+    def __init__(self, method, chat_id, kwargs, priority, merge_key=None, fallback=None, retries=0):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.merge_key = merge_key
+        self.fallback = fallback
+        self.retries = retries
+        self.attempt = 0
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.seq = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Outbox:
+    """Priority queue that every outgoing message goes through.
+
+    Sends are paced by a global token bucket and one bucket per chat. At most
+    one request per chat is in flight, so messages to a chat keep their order
+    within a priority class. When more than ``max_queue`` requests are waiting
+    the oldest lowest-priority request is shed; welcomes are never shed.
+    Requests with a ``merge_key`` replace a still-pending request for the same
+    method with the same key in the same chat instead of queueing behind it.
+
+    Transient network failures are retried up to ``retries`` times after an
+    exponential, jittered backoff without holding a sender thread. Each API
+    method has a circuit breaker, opened by transient failures only: while it
+    is open, requests that have a fallback go straight to the fallback
+    instead of paying for a doomed call.
+    """
+
+    def __init__(self, global_rate=30.0, chat_rate=20 / 60, chat_burst=5, max_queue=1000, workers=4,
+                 breaker_threshold=5, breaker_reset=60.0):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.workers = workers
+        self.bot = None
+        self._chats = {}
+        self._buckets = {}
+        self._busy = set()
+        self._delayed = []
+        self._breakers = {}
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self._depth = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._stats = {'sent': 0, 'failed': 0, 'dropped': 0, 'merged': 0, 'retried': 0,
+                       'short_circuited': 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self, bot):
+        """Start the sender threads using ``bot`` for the actual API calls."""
+        self.bot = bot
+        self._running = True
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=0.0):
+        """Stop the sender threads after sending what is queued for up to ``timeout`` seconds.
+
+        Requests still queued (or waiting to be retried) after that are abandoned.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._running and (self._depth or self._busy):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            abandoned = self._depth
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if abandoned:
+            logger.warning(f"Abandoned {abandoned} queued requests at shutdown")
+
+    def submit(self, method, chat_id, priority=PRIORITY_FUN, merge_key=None, fallback=None, retries=0,
+               **kwargs):
+        """Queue ``bot.<method>(chat_id=chat_id, **kwargs)`` and return a Future for its result.
+
+        ``fallback`` is an optional ``(method, kwargs)`` pair sent instead if the call fails.
+        """
+        request = OutboundRequest(method, chat_id, kwargs, priority, merge_key, fallback, retries)
+        with self._cond:
+            if merge_key is not None:
+                for pending in self._chats.get(chat_id, ()):
+                    # The kwargs only make sense for the method they were built for
+                    if pending.merge_key == merge_key and pending.method == method:
+                        pending.kwargs = kwargs
+                        pending.fallback = fallback
+                        self._stats['merged'] += 1
+                        return pending.future
+            if self._depth >= self.max_queue and not self._shed(priority):
+                self._stats['dropped'] += 1
+                request.future.set_exception(QueueFull(f"outbound queue full, dropped {method}"))
+                return request.future
+            request.seq = next(self._seq)
+            heapq.heappush(self._chats.setdefault(chat_id, []), request)
+            self._depth += 1
+            self._cond.notify()
+        return request.future
+
+    def send_message(self, chat_id, text, priority=PRIORITY_FUN, merge_key=None, fallback=None, **kwargs):
+        return self.submit('send_message', chat_id, priority, merge_key, fallback, text=text, **kwargs)
+
+    def send_sticker(self, chat_id, sticker, priority=PRIORITY_STICKER, merge_key=None, fallback=None,
+                     retries=2, **kwargs):
+        return self.submit('send_sticker', chat_id, priority, merge_key, fallback, retries,
+                           sticker=sticker, **kwargs)
+
+    def reply(self, message, text, priority=PRIORITY_FUN, merge_key=None, fallback=None, **kwargs):
+        """Queue a reply to ``message``, the equivalent of ``message.reply_text``."""
+        kwargs.setdefault('reply_to_message_id', message.message_id)
+        kwargs.setdefault('allow_sending_without_reply', True)
+        return self.send_message(message.chat_id, text, priority, merge_key, fallback, **kwargs)
+
+    def stats(self):
+        """Queue depth per priority and wait-time figures since start."""
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for queue in self._chats.values():
+                for request in queue:
+                    depth[PRIORITY_NAMES.get(request.priority, str(request.priority))] += 1
+            sent = self._stats['sent'] + self._stats['failed']
+            return dict(
+                self._stats,
+                depth=self._depth,
+                depth_by_priority=depth,
+                chats_waiting=sum(1 for queue in self._chats.values() if queue),
+                retrying=len(self._delayed),
+                breakers={method: breaker.state for method, breaker in self._breakers.items()},
+                wait_avg=self._wait_total / sent if sent else 0.0,
+                wait_max=self._wait_max,
+            )
+
+    def _shed(self, priority):
+        """Drop the oldest request of the lowest class below ``priority``; welcomes are never dropped."""
+        victim = None
+        for queue in self._chats.values():
+            for request in queue:
+                if request.priority <= priority:
+                    continue
+                if victim is None or (-request.priority, request.seq) < (-victim.priority, victim.seq):
+                    victim = request
+        if victim is None:
+            return False
+        queue = self._chats[victim.chat_id]
+        queue.remove(victim)
+        if queue:
+            heapq.heapify(queue)
+        else:
+            del self._chats[victim.chat_id]
+        self._depth -= 1
+        self._stats['dropped'] += 1
+        victim.future.set_exception(QueueFull(f"outbound queue full, dropped {victim.method}"))
+        return True
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _breaker(self, method):
+        breaker = self._breakers.get(method)
+        if breaker is None:
+            breaker = self._breakers[method] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        return breaker
+
+    def _next(self):
+        """Pick the best sendable request, or return how long to wait for one."""
+        now = time.monotonic()
+        wait = None
+        best = None
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, request = heapq.heappop(self._delayed)
+            heapq.heappush(self._chats.setdefault(request.chat_id, []), request)
+        if self._delayed:
+            wait = self._delayed[0][0] - now
+        for chat_id, queue in self._chats.items():
+            if not queue or chat_id in self._busy:
+                continue
+            delay = self._bucket(chat_id).delay(now)
+            if delay:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or queue[0] < best[0]:
+                best = queue
+        if best is None:
+            return None, wait
+        delay = self.global_bucket.delay(now)
+        if delay:
+            return None, delay
+        request = heapq.heappop(best)
+        if not best:
+            del self._chats[request.chat_id]
+        self._depth -= 1
+        self.global_bucket.take()
+        self._bucket(request.chat_id).take()
+        self._busy.add(request.chat_id)
+        return request, None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    request, wait = self._next()
+                    if request is not None:
+                        break
+                    self._cond.wait(wait)
+            try:
+                self._send(request)
+            finally:
+                with self._cond:
+                    self._busy.discard(request.chat_id)
+                    self._cond.notify_all()
+
+    def _send(self, request):
+        waited = time.monotonic() - request.enqueued
+        breaker = self._breaker(request.method)
+        if request.fallback is not None and not breaker.allow():
+            # Known to be failing right now: go straight to the fallback
+            request.method, request.kwargs = request.fallback
+            request.fallback = None
+            breaker = self._breaker(request.method)
+            with self._cond:
+                self._stats['short_circuited'] += 1
+        try:
+            result = getattr(self.bot, request.method)(chat_id=request.chat_id, **request.kwargs)
+        except RetryAfter as e:
+            logger.warning("Flood control in chat %s, retrying in %ss", request.chat_id, e.retry_after,
+                           extra={'event': 'flood', 'chat_id': request.chat_id, 'method': request.method})
+            with self._cond:
+                self._bucket(request.chat_id).block(time.monotonic(), e.retry_after)
+                self._stats['retried'] += 1
+                heapq.heappush(self._chats.setdefault(request.chat_id, []), request)
+                self._depth += 1
+            return
+        except Exception as e:
+            # The breaker is shared by every chat, so only the endpoint's own trouble counts against it;
+            # a request refused for one chat (blocked, kicked, bad arguments) means the endpoint answered
+            if is_transient(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if is_transient(e) and request.attempt < request.retries:
+                delay = backoff_delay(request.attempt)
+                request.attempt += 1
+                logger.warning("%s failed in chat %s, retry %d/%d in %.1fs: %s", request.method,
+                               request.chat_id, request.attempt, request.retries, delay, e,
+                               extra={'event': 'retry', 'chat_id': request.chat_id, 'method': request.method})
+                with self._cond:
+                    self._stats['retried'] += 1
+                    heapq.heappush(self._delayed, (time.monotonic() + delay, request.seq, request))
+                    self._depth += 1
+                return
+            with self._cond:
+                self._record_wait(waited, 'failed')
+            if request.fallback is not None:
+                method, kwargs = request.fallback
+                logger.warning(f"{request.method} failed in chat {request.chat_id}, sending fallback: {e}")
+                fallback = self.submit(method, request.chat_id, request.priority, **kwargs)
+                fallback.add_done_callback(lambda done: _chain(done, request.future))
+            else:
+                logger.error(f"{request.method} failed in chat {request.chat_id}: {e}")
+                request.future.set_exception(e)
+            return
+        breaker.record_success()
+        with self._cond:
+            self._record_wait(waited, 'sent')
+        request.future.set_result(result)
+
+    def _record_wait(self, waited, outcome):
+        self._stats[outcome] += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+
+def _chain(source, target):
+    """Copy the outcome of one future onto another."""
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
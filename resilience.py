@@ -0,0 +1,58 @@
+"""Retry backoff and circuit breaking for Bot API calls."""
+import random
+import threading
+import time
+
+from telegram.error import BadRequest, NetworkError
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Exponential backoff with full jitter for the given (0-based) retry attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_transient(error):
+    """Whether a failed call is worth retrying: network trouble, not a rejected request."""
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+
+class CircuitBreaker:
+    """Stop calling an endpoint that keeps failing.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    ``allow`` returns False for ``reset_timeout`` seconds. It then lets a
+    single trial call through; success closes it again, failure re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
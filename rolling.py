@@ -0,0 +1,42 @@
+"""Fixed-size rings of daily message counters for rolling-window stats."""
+from array import array
+
+# One bucket per day: enough for a 31-day window including today.
+RING_DAYS = 32
+MAX_WINDOW_DAYS = RING_DAYS - 1
+
+
+class DayRing:
+    """Per-member message counts for the last ``RING_DAYS`` days.
+
+    Days are proleptic Gregorian ordinals (``date.toordinal()``). Buckets are
+    recycled lazily as newer days are written, so nothing ever has to be
+    cleared at a week or month boundary.
+    """
+
+    __slots__ = ('day', 'counts')
+
+    def __init__(self):
+        self.day = None
+        self.counts = array('I', bytes(4 * RING_DAYS))
+
+    def add(self, day, count=1):
+        """Add ``count`` messages to ``day``; days older than the ring are ignored."""
+        if self.day is None:
+            self.day = day
+        elif day > self.day:
+            for stale in range(max(self.day + 1, day - RING_DAYS + 1), day + 1):
+                self.counts[stale % RING_DAYS] = 0
+            self.day = day
+        elif day <= self.day - RING_DAYS:
+            return
+        self.counts[day % RING_DAYS] += count
+
+    def total(self, days, today):
+        """Sum the ``days`` buckets ending at ``today`` (inclusive)."""
+        if self.day is None:
+            return 0
+        first = max(today - days + 1, self.day - RING_DAYS + 1)
+        last = min(today, self.day)
+        counts = self.counts
+        return sum(counts[day % RING_DAYS] for day in range(first, last + 1))
@@ -0,0 +1,135 @@
+"""No-repeat content rotation with compact, per-chat persisted state."""
+import json
+import logging
+import os
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+MASK64 = (1 << 64) - 1
+ROUNDS = 4
+
+
+def _mix(x):
+    """64-bit integer hash (the splitmix64 finaliser)."""
+    x = (x * 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class ShuffleBag:
+    """Hand out ``0..size-1`` in random order, each once per cycle.
+
+    A cycle's order is a permutation keyed by a stored seed, so the whole
+    state is the three integers ``(size, seed, pos)``. The permutation is a
+    small Feistel network over the next power of four at or above ``size``;
+    results outside the range are fed through again (cycle-walking) until
+    one lands inside. Nothing is materialised, so a bag takes the same few
+    bytes whatever the corpus size, and a draw costs a handful of rounds.
+    The first item of a new cycle never repeats the last item of the
+    previous one.
+    """
+
+    __slots__ = ('size', 'seed', 'pos', '_half', '_keys')
+
+    def __init__(self, size, seed=None, pos=0):
+        self.size = size
+        self.seed = seed
+        self.pos = pos
+        self._half = max(1, (max(size - 1, 1).bit_length() + 1) // 2)
+        self._keys = None
+        if seed is None or not 0 <= pos <= size:
+            self._new_cycle(None)
+
+    def draw(self):
+        if self.pos >= self.size:
+            self._new_cycle(self._permute(self.size - 1))
+        index = self._permute(self.pos)
+        self.pos += 1
+        return index
+
+    def state(self):
+        return [self.size, self.seed, self.pos]
+
+    def _permute(self, index):
+        """Position ``index`` of this cycle's order."""
+        keys = self._keys
+        if keys is None:
+            rng = random.Random(self.seed)
+            keys = self._keys = [rng.getrandbits(64) for _ in range(ROUNDS)]
+        half = self._half
+        mask = (1 << half) - 1
+        while True:
+            left, right = index >> half, index & mask
+            for key in keys:
+                left, right = right, left ^ (_mix(right ^ key) & mask)
+            index = (left << half) | right
+            if index < self.size:
+                return index
+
+    def _new_cycle(self, last):
+        while True:
+            self.seed = random.getrandbits(32)
+            self.pos = 0
+            self._keys = None
+            if self.size < 2 or self._permute(0) != last:
+                return
+
+
+class Rotations:
+    """Shuffle bags per content list and chat, saved to ``path`` as JSON."""
+
+    def __init__(self, path='rotation.json'):
+        self.path = path
+        self._bags = {}
+        self._dirty = False
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def draw(self, name, chat_id, size):
+        """Next index into the ``size``-item list ``name`` for ``chat_id``."""
+        if not self._loaded:
+            self.load()
+        key = (name, chat_id)
+        with self._lock:
+            bag = self._bags.get(key)
+            if bag is None or bag.size != size:
+                bag = self._bags[key] = ShuffleBag(size)
+            self._dirty = True
+            return bag.draw()
+
+    def load(self):
+        """Restore saved bags; called on the first draw if not called before."""
+        self._loaded = True
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable rotation state {self.path}: {e}")
+            return
+        with self._lock:
+            for name, chats in saved.items():
+                for chat_id, (size, seed, pos) in chats.items():
+                    self._bags[(name, int(chat_id))] = ShuffleBag(size, seed, pos)
+
+    def save(self):
+        """Write the state out if anything was drawn since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            saved = {}
+            for (name, chat_id), bag in self._bags.items():
+                saved.setdefault(name, {})[str(chat_id)] = bag.state()
+            self._dirty = False
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Couldn't save rotation state: {e}")
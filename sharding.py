@@ -0,0 +1,81 @@
+"""Routing of updates to worker processes by chat, for the sharded mode (SHARDS > 1)."""
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(key, shards):
+    """Shard that owns ``key`` (a chat id); stable across restarts for a given shard count."""
+    return hash(key) % shards
+
+
+def shard_path(path, shard):
+    """Per-shard variant of a state file path, e.g. rotation.json -> rotation-2.json."""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{shard}{ext}"
+
+
+class ShardRouter:
+    """Run ``target(shard, shards, updates)`` in ``shards`` processes and route updates to them.
+
+    All updates of a chat go to the same worker, which handles them in the
+    order they arrived, so per-chat ordering is kept and each worker owns the
+    in-memory state of its chats. Updates travel as JSON strings over a
+    bounded queue per worker; a full queue blocks the ingest side. ``None`` on
+    the queue tells a worker to shut down.
+    """
+
+    def __init__(self, target, shards, max_queue=10000):
+        self.target = target
+        self.shards = shards
+        self.routed = [0] * shards
+        # Spawned rather than forked: the parent already runs logging and HTTP threads
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(max_queue) for _ in range(shards)]
+        self._processes = [None] * shards
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+        logger.info(f"Started {self.shards} shard workers")
+
+    def route(self, update, context):
+        """Dispatcher callback that forwards an update to the worker owning its chat."""
+        chat = update.effective_chat
+        user = update.effective_user
+        key = chat.id if chat else user.id if user else update.update_id
+        shard = shard_of(key, self.shards)
+        self._queues[shard].put(json.dumps(update.to_dict()))
+        self.routed[shard] += 1
+
+    def check(self, context=None):
+        """Restart workers that have died; runs as a repeating job."""
+        for shard, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Shard {shard} exited with code {process.exitcode}, restarting it")
+                self._spawn(shard)
+
+    def stop(self, timeout=30):
+        """Ask every worker to finish its queue and exit, terminating any that don't within ``timeout`` seconds."""
+        for updates in self._queues:
+            updates.put(None)
+        # The workers stop side by side, so they share one deadline
+        deadline = time.monotonic() + timeout
+        for shard, process in enumerate(self._processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Shard {shard} didn't stop within {timeout}s, terminating it")
+                process.terminate()
+        self._processes = [None] * self.shards
+
+    def _spawn(self, shard):
+        process = self._context.Process(target=self.target, args=(shard, self.shards, self._queues[shard]),
+                                        name=f"shard-{shard}")
+        process.start()
+        self._processes[shard] = process
@@ -2,5 +2,8 @@
 # Install dependencies
 pip install -r requirements.txt
 
+# Build the joke/quote corpora
+python tools/build_corpus.py
+
 # Run the bot
 python bot.py
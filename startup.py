@@ -0,0 +1,54 @@
+"""Startup phase timing, from the first import to the first dispatched update."""
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfiler:
+    """Record how long each import and init step takes.
+
+    ``report`` lists the phases; ``first_update`` stamps the moment the first
+    update reaches the dispatcher and logs the full report, since that is the
+    figure that matters after a redeploy.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.ready_at = None
+        self.first_update_at = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def ready(self):
+        """Mark the bot as listening for updates."""
+        self.ready_at = time.perf_counter()
+        logger.info(f"Ready for updates {self.ready_at - self.started:.3f}s after start")
+
+    def first_update(self, update, context):
+        """Dispatcher callback (group -100) that stamps the first update once."""
+        if self.first_update_at is None:
+            self.first_update_at = time.perf_counter()
+            logger.info(self.report())
+
+    def report(self):
+        lines = ["Startup timing:"]
+        for name, elapsed in self.phases:
+            lines.append(f"  {name:<32} {elapsed * 1000:9.1f} ms")
+        if self.ready_at is not None:
+            lines.append(f"  {'= ready for updates':<32} {(self.ready_at - self.started) * 1000:9.1f} ms")
+        if self.first_update_at is not None:
+            lines.append(f"  {'= first update dispatched':<32} "
+                         f"{(self.first_update_at - self.started) * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+
+profiler = StartupProfiler()
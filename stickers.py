@@ -0,0 +1,108 @@
+"""Catalogue of sendable sticker file_ids, indexed by emoji."""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_emoji(emoji):
+    """Drop variation selectors so '❤️' and '❤' index the same stickers."""
+    return emoji.replace('\ufe0f', '') if emoji else emoji
+
+
+class StickerCatalogue:
+    """Emoji → ``file_id`` index built from configured sticker sets.
+
+    The index is fetched from the Bot API once, saved to ``path`` and loaded
+    from there on later starts, so a restart needs no API calls. A JobQueue
+    job refreshes it in the background every ``refresh_interval`` seconds.
+    """
+
+    def __init__(self, set_names, path='stickers.json', refresh_interval=86400.0):
+        self.set_names = [name for name in set_names if name]
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.updated = 0.0
+        self._index = {}
+        self._all = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._all)
+
+    def load(self):
+        """Load the index saved by a previous run; returns False if it is missing or stale."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable sticker catalogue {self.path}: {e}")
+            return False
+        if saved.get('sets') != self.set_names:
+            return False
+        self._set_index(saved.get('stickers', {}))
+        self.updated = saved.get('updated', 0.0)
+        return time.time() - self.updated < self.refresh_interval
+
+    def refresh(self, bot):
+        """Fetch every configured set and rebuild the index."""
+        index = {}
+        for name in self.set_names:
+            try:
+                sticker_set = bot.get_sticker_set(name)
+            except Exception as e:
+                logger.warning(f"Couldn't fetch sticker set {name}: {e}")
+                continue
+            for sticker in sticker_set.stickers:
+                index.setdefault(normalize_emoji(sticker.emoji) or '', []).append(sticker.file_id)
+        if not index:
+            return False
+        self._set_index(index)
+        self.updated = time.time()
+        self._save(index)
+        logger.info(f"Sticker catalogue refreshed: {len(self)} stickers from {len(self.set_names)} sets")
+        return True
+
+    def pick(self, emoji=None):
+        """Return a random ``file_id`` for ``emoji`` (any sticker if None), or None."""
+        with self._lock:
+            if emoji is None:
+                candidates = self._all
+            else:
+                candidates = self._index.get(normalize_emoji(emoji))
+        return random.choice(candidates) if candidates else None
+
+    def schedule(self, job_queue):
+        """Load and then keep the index current from the JobQueue, off the startup path.
+
+        The first run loads the saved index and only fetches from the API if
+        that copy is missing or stale.
+        """
+        if not self.set_names:
+            return
+
+        def run(context):
+            if self.updated or not self.load():
+                self.refresh(context.bot)
+
+        job_queue.run_repeating(run, self.refresh_interval, first=0, name='sticker-catalogue')
+
+    def _set_index(self, index):
+        with self._lock:
+            self._index = index
+            self._all = [file_id for file_ids in index.values() for file_id in file_ids]
+
+    def _save(self, index):
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'sets': self.set_names, 'updated': self.updated, 'stickers': index}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Couldn't save sticker catalogue: {e}")
@@ -0,0 +1,41 @@
+"""Build memory-mapped corpus files from text/JSON sources.
+
+With no arguments every ``content/*.json`` and ``content/*.txt`` source is
+built into ``content/<name>.corpus``:
+
+    python tools/build_corpus.py
+    python tools/build_corpus.py my_jokes.txt content/jokes.corpus
+"""
+import argparse
+import glob
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from corpus import Corpus, build, read_source  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', nargs='?', help='.json list or .txt file with one record per line')
+    parser.add_argument('target', nargs='?', help='corpus file to write')
+    args = parser.parse_args()
+
+    if args.source:
+        jobs = [(args.source, args.target or os.path.splitext(args.source)[0] + '.corpus')]
+    else:
+        content = os.path.join(ROOT, 'content')
+        sources = sorted(glob.glob(os.path.join(content, '*.json')) + glob.glob(os.path.join(content, '*.txt')))
+        jobs = [(source, os.path.splitext(source)[0] + '.corpus') for source in sources]
+
+    for source, target in jobs:
+        build(read_source(source), target)
+        corpus = Corpus(target)
+        print(f"{source} -> {target}: {len(corpus)} records, {os.path.getsize(target)} bytes")
+        corpus.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Minimal local stand-in for the Telegram Bot API.
+
+Point a bot at it with ``Bot(token, base_url=api.base_url)`` (or
+``Updater(token, base_url=api.base_url)``). Every call is answered with a
+plausible result, or a configured error status, and counted, so sends can be
+exercised and measured without a real token or network access. Updates
+queued with ``push_update`` are served through ``getUpdates``.
+
+    python tools/fake_bot_api.py --port 8081 --latency 0.05
+"""
+import argparse
+import email.parser
+import itertools
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_bot'}
+
+MESSAGE_METHODS = {
+    'sendMessage', 'sendSticker', 'sendDocument', 'sendPhoto', 'editMessageText',
+    'editMessageReplyMarkup',
+}
+
+
+def _parse_body(content_type, body):
+    """Decode a JSON or multipart/form-data request body into a dict."""
+    if not body:
+        return {}
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser().parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        data = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            if part.get_filename():
+                data[name] = {'filename': part.get_filename(), 'size': len(payload)}
+            else:
+                data[name] = payload.decode('utf-8', 'replace')
+        return data
+    return json.loads(body)
+
+
+class FakeBotAPI:
+    """Threaded HTTP server that answers Bot API calls and records them."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, member_count=42,
+                 chat_interval=None, sticker_sets=None, failures=None):
+        self.latency = latency
+        self.failures = failures or {}
+        self.member_count = member_count
+        self.chat_interval = chat_interval
+        self.sticker_sets = sticker_sets or {}
+        self.calls = Counter()
+        self.sent = []
+        self.flood_errors = 0
+        self._updates = deque()
+        self._updates_ready = threading.Condition()
+        self._last_send = defaultdict(float)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def push_update(self, update):
+        """Queue a raw update dict to be returned by the next ``getUpdates``."""
+        with self._updates_ready:
+            self._updates.append(update)
+            self._updates_ready.notify_all()
+
+    def pending_updates(self):
+        with self._updates_ready:
+            return len(self._updates)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.sent.clear()
+            self.flood_errors = 0
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                length = int(self.headers.get('Content-Length') or 0)
+                data = _parse_body(self.headers.get('Content-Type', ''), self.rfile.read(length))
+                status, payload = api._dispatch(method, data)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _dispatch(self, method, data):
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(data)}
+
+        if self.latency:
+            time.sleep(self.latency)
+        chat_id = data.get('chat_id')
+        now = time.monotonic()
+        with self._lock:
+            self.calls[method] += 1
+            if method in self.failures:
+                code = self.failures[method]
+                return code, {'ok': False, 'error_code': code, 'description': f"Bad Request: {method} failed"}
+            if method in MESSAGE_METHODS and chat_id is not None:
+                if self.chat_interval and now - self._last_send[chat_id] < self.chat_interval:
+                    self.flood_errors += 1
+                    retry_after = max(1, int(self.chat_interval))
+                    return 429, {
+                        'ok': False, 'error_code': 429,
+                        'description': f"Too Many Requests: retry after {retry_after}",
+                        'parameters': {'retry_after': retry_after},
+                    }
+                self._last_send[chat_id] = now
+                self.sent.append((now, method, chat_id, data))
+        return 200, {'ok': True, 'result': self._result(method, data)}
+
+    def _get_updates(self, data):
+        offset = int(data.get('offset') or 0)
+        limit = int(data.get('limit') or 100)
+        timeout = min(float(data.get('timeout') or 0), 1.0)
+        with self._updates_ready:
+            while self._updates and self._updates[0]['update_id'] < offset:
+                self._updates.popleft()
+            if not self._updates and timeout:
+                self._updates_ready.wait(timeout)
+            batch = []
+            while self._updates and len(batch) < limit:
+                batch.append(self._updates.popleft())
+            return batch
+
+    def _result(self, method, data):
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('getChatMemberCount', 'getChatMembersCount'):
+            return self.member_count
+        if method == 'getUserProfilePhotos':
+            return {'total_count': 0, 'photos': []}
+        if method == 'getChatMember':
+            return {'status': 'administrator', 'user': {'id': int(data.get('user_id', 0)),
+                                                        'is_bot': False, 'first_name': 'Admin'}}
+        if method == 'getStickerSet':
+            name = data.get('name')
+            return {
+                'name': name, 'title': name, 'is_animated': False, 'is_video': False,
+                'contains_masks': False, 'sticker_type': 'regular',
+                'stickers': [
+                    {'file_id': f"{name}-{idx}", 'file_unique_id': f"{name}-u{idx}", 'width': 512,
+                     'height': 512, 'is_animated': False, 'is_video': False, 'emoji': emoji,
+                     'type': 'regular'}
+                    for idx, emoji in enumerate(self.sticker_sets.get(name, ['😊', '🎉', '👋']))
+                ],
+            }
+        if method in MESSAGE_METHODS:
+            chat_id = data.get('chat_id', 0)
+            message = {
+                'message_id': int(data.get('message_id') or next(self._message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id), 'type': 'supergroup', 'title': 'Fake chat'},
+                'from': BOT_USER,
+            }
+            if 'text' in data:
+                message['text'] = data['text']
+            return message
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--chat-interval', type=float, default=None,
+                        help='answer 429 to sends closer together than this in one chat')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.host, args.port, args.latency, chat_interval=args.chat_interval).start()
+    print(f"Fake Bot API listening, base_url={api.base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.stop()
+        print(json.dumps(dict(api.calls), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""POST recorded updates to a running webhook server.
+
+Reads a JSON file holding one update or a list of them, or a JSONL file
+with one update per line, and posts each to the given URL:
+
+    python tools/post_updates.py http://127.0.0.1:8443/telegram updates.jsonl --secret s3cret
+"""
+import argparse
+import json
+import time
+import urllib.request
+from urllib.error import HTTPError
+
+
+def read_updates(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
+
+
+def post(url, update, secret=None):
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('path', help='JSON or JSONL file of updates')
+    parser.add_argument('--secret', default=None, help='value for the secret token header')
+    args = parser.parse_args()
+
+    updates = read_updates(args.path)
+    statuses = {}
+    start = time.perf_counter()
+    for update in updates:
+        status = post(args.url, update, args.secret)
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - start
+    print(f"posted {len(updates)} updates in {elapsed:.3f}s "
+          f"({elapsed / max(len(updates), 1) * 1000:.2f} ms each), statuses: {statuses}")
+
+
+if __name__ == '__main__':
+    main()
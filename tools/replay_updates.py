@@ -0,0 +1,132 @@
+"""Replay a recorded update log (UPDATE_LOG) through the bot, offline.
+
+The bot runs with all its handlers against tools/fake_bot_api.py and a fresh
+activity store in a temporary directory. Updates are served at the recorded
+pace scaled by --speed, or as fast as possible with --speed max. Afterwards
+each chat's message counts and leaderboard are checked against the state
+saved at the end of the recording; the exit status is 1 on any mismatch.
+
+    python tools/replay_updates.py updates-20240601.jsonl.gz --speed 10
+"""
+import argparse
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from traffic import read_log  # noqa: E402
+
+
+def load(path):
+    updates, state = [], None
+    for entry in read_log(path):
+        if 'update' in entry:
+            updates.append((entry['t'], entry['update']))
+        elif 'state' in entry:
+            state = entry['state']
+    return updates, state
+
+
+def verify(activity, state):
+    """Compare the replayed activity with the recorded state; returns a list of problems."""
+    problems = []
+    for chat_key, expected in state.items():
+        stats = activity.chat(int(chat_key))
+        actual = {str(user_id): member.messages for user_id, member in stats.members.items()
+                  if member.messages}
+        if actual != expected:
+            missing = sorted(set(expected) - set(actual))
+            wrong = sorted(key for key in expected if key in actual and actual[key] != expected[key])
+            extra = sorted(set(actual) - set(expected))
+            problems.append(f"chat {chat_key}: {len(missing)} missing, {len(wrong)} wrong, "
+                            f"{len(extra)} unexpected member counts")
+        board = [count for count, _ in stats.weekly_top.entries()]
+        top = sorted(expected.values(), reverse=True)[:stats.weekly_top.size]
+        if board != top:
+            problems.append(f"chat {chat_key}: weekly leaderboard {board} != expected {top}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='gzipped JSONL update log')
+    parser.add_argument('--speed', default='max', help="pace multiplier, e.g. 1 or 10, or 'max'")
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for the replay to finish')
+    args = parser.parse_args()
+    speed = None if args.speed == 'max' else float(args.speed)
+
+    updates, state = load(args.path)
+    print(f"{len(updates)} updates in {args.path}")
+
+    workdir = tempfile.mkdtemp(prefix='replay-')
+    api = FakeBotAPI().start()
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123:replay',
+        'TELEGRAM_BASE_URL': api.base_url,
+        'ACTIVITY_DB': os.path.join(workdir, 'activity.db'),
+        'METRICS_PORT': '',
+        'BOT_MODE': 'polling',
+        'UPDATE_LOG': '',
+    })
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.chdir(workdir)
+
+    import bot
+
+    # The startup profiler's callback sees every update first; count dispatched updates there
+    dispatched = [0]
+    first_update = bot.profiler.first_update
+
+    def count(update, context):
+        dispatched[0] += 1
+        first_update(update, context)
+    bot.profiler.first_update = count
+
+    problems = []
+
+    def drive():
+        try:
+            while bot.profiler.ready_at is None:
+                time.sleep(0.01)
+            start = time.monotonic()
+            first = updates[0][0] if updates else 0
+            for t, update in updates:
+                if speed:
+                    delay = start + (t - first) / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                api.push_update(update)
+            deadline = time.monotonic() + args.timeout
+            while dispatched[0] < len(updates) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            elapsed = time.monotonic() - start
+            print(f"replayed {dispatched[0]}/{len(updates)} updates in {elapsed:.2f}s "
+                  f"({dispatched[0] / elapsed if elapsed else 0:.0f}/s)")
+            if state is None:
+                problems.append("log has no final state (recording wasn't closed cleanly)")
+            else:
+                problems.extend(verify(bot.activity, state))
+            time.sleep(1)
+            print(f"outbound calls: {dict(api.calls)}")
+        finally:
+            os.kill(os.getpid(), signal.SIGINT)
+
+    threading.Thread(target=drive, name='replay-driver', daemon=True).start()
+    bot.main()
+    api.stop()
+
+    for problem in problems:
+        print(problem)
+    print("state matches the recording" if not problems else f"{len(problems)} mismatches")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
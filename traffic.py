@@ -0,0 +1,146 @@
+"""Capture of incoming updates to gzipped JSON lines, for offline replay.
+
+A log has one ``{"t": unix time, "update": {...}}`` object per update and,
+once the recorder is closed, a final ``{"state": ...}`` object: the message
+count each member gained in each chat while recording. ``tools/replay_updates.py``
+replays a log and checks its result against that state.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Anonymiser:
+    """Replace user ids, names and message text with stable stand-ins.
+
+    The same user always maps to the same pseudonymous id within a log (the
+    ids come from an HMAC under a random per-recording key), so per-member
+    statistics survive. Message text is replaced with filler of the same
+    UTF-16 length, keeping entity offsets valid; commands are kept as they are.
+    """
+
+    def __init__(self, key=None):
+        self.key = key or os.urandom(16)
+        self._ids = {}
+
+    def user_id(self, user_id):
+        pseudonym = self._ids.get(user_id)
+        if pseudonym is None:
+            digest = hmac.new(self.key, str(user_id).encode(), hashlib.sha256).digest()
+            pseudonym = self._ids[user_id] = 10 ** 12 + int.from_bytes(digest[:5], 'big')
+        return pseudonym
+
+    def user(self, user):
+        user_id = self.user_id(user['id'])
+        anonymised = {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id % 100000}"}
+        if 'username' in user:
+            anonymised['username'] = f"user{user_id}"
+        return anonymised
+
+    def __call__(self, value):
+        if isinstance(value, list):
+            return [self(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if 'is_bot' in value and 'id' in value:
+            return value if value['is_bot'] else self.user(value)
+        anonymised = {}
+        for key, item in value.items():
+            if key == 'chat' and item.get('type') == 'private':
+                anonymised[key] = {'id': self.user_id(item['id']), 'type': 'private'}
+            elif key in ('text', 'caption') and isinstance(item, str) and not item.startswith('/'):
+                anonymised[key] = 'x' * (len(item.encode('utf-16-le')) // 2)
+            else:
+                anonymised[key] = self(item)
+        return anonymised
+
+
+class UpdateRecorder:
+    """Write every incoming update to ``path`` from a background thread.
+
+    ``path`` may contain strftime codes (``updates-%Y%m%d-%H%M%S.jsonl.gz``) so
+    that each run gets its own log. Register ``record`` as a dispatcher
+    callback in a negative group, ahead of the handlers that count activity.
+    """
+
+    def __init__(self, path, anonymise=False):
+        self.path = time.strftime(path)
+        self.anonymiser = Anonymiser() if anonymise else None
+        self.recorded = 0
+        self._activity = None
+        self._baselines = {}
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def start(self, activity):
+        """Start writing; ``activity`` is the ActivityStore the final state is read from."""
+        self._activity = activity
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='update-recorder', daemon=True)
+        self._thread.start()
+        logger.info(f"Recording updates to {self.path}")
+
+    def record(self, update, context):
+        chat = update.effective_chat
+        if chat is not None and chat.id not in self._baselines:
+            # Counts before this chat's first recorded update, so the state only reflects the log
+            members = self._activity.chat(chat.id).members
+            self._baselines[chat.id] = {user_id: member.messages for user_id, member in members.items()}
+        self._queue.put({'t': time.time(), 'update': update})
+        self.recorded += 1
+
+    def close(self):
+        """Append the final state and finish the file."""
+        if self._thread is None:
+            return
+        self._queue.put({'state': self._state()})
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        logger.info(f"Recorded {self.recorded} updates to {self.path}")
+
+    def _state(self):
+        state = {}
+        for chat_id, baseline in self._baselines.items():
+            gained = {}
+            for user_id, member in self._activity.chat(chat_id).members.items():
+                delta = member.messages - baseline.get(user_id, 0)
+                if delta:
+                    if self.anonymiser:
+                        user_id = self.anonymiser.user_id(user_id)
+                    gained[str(user_id)] = delta
+            if gained:
+                if self.anonymiser and chat_id > 0:
+                    chat_id = self.anonymiser.user_id(chat_id)
+                state[str(chat_id)] = gained
+        return state
+
+    def _run(self):
+        with self._file:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    return
+                try:
+                    if 'update' in entry:
+                        data = entry['update'].to_dict()
+                        entry['update'] = self.anonymiser(data) if self.anonymiser else data
+                    self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+                except Exception as e:
+                    logger.error(f"Couldn't record update: {e}")
+
+
+def read_log(path):
+    """Yield the entries of an update log in order."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
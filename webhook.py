@@ -0,0 +1,132 @@
+"""Embedded HTTP server that receives updates pushed by Telegram."""
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """Accept webhook POSTs and feed them to a dispatcher's update queue.
+
+    A request is answered as soon as its JSON has been parsed and queued; the
+    handlers run later on the dispatcher thread, so Telegram never waits on
+    them. Bodies larger than ``max_body`` bytes are refused with 413, and if
+    ``secret_token`` is set, requests without the matching secret header are
+    refused with 403.
+    """
+
+    def __init__(self, dispatcher, host='0.0.0.0', port=8443, path='/telegram',
+                 secret_token=None, max_body=1024 * 1024):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body = max_body
+        self.received = 0
+        self.rejected = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='webhook', daemon=True)
+        self._thread.start()
+        logger.info(f"Webhook server listening on port {self.port}{self.path}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def _accept(self, headers, read):
+        """Check one webhook request and decode its body; returns (HTTP status, update data)."""
+        if self.secret_token is not None and not hmac.compare_digest(
+                headers.get(SECRET_HEADER, ''), self.secret_token):
+            return 403, None
+        length = headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            return 411, None
+        if int(length) > self.max_body:
+            return 413, None
+        try:
+            data = json.loads(read(int(length)))
+        except ValueError:
+            return 400, None
+        return 200, data
+
+    def _enqueue(self, data):
+        try:
+            update = Update.de_json(data, self.dispatcher.bot)
+        except Exception as e:
+            logger.error(f"Couldn't decode webhook update: {e}")
+            return
+        self.dispatcher.update_queue.put(update)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._respond(404)
+                    return
+                status, data = server._accept(self.headers, self.rfile.read)
+                if status != 200:
+                    server.rejected += 1
+                    self.close_connection = True
+                    self._respond(status)
+                    return
+                server.received += 1
+                self._respond(200)
+                server._enqueue(data)
+
+            def do_GET(self):
+                # Health check for the hosting platform
+                if self.path == '/':
+                    self._respond(200, b'ok')
+                else:
+                    self._respond(404)
+
+            def _respond(self, status, body=b'', content_type='text/plain'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def start_webhook(updater, url, secret_token=None, **server_kwargs):
+    """Run ``updater``'s dispatcher and job queue behind a WebhookServer.
+
+    This is the webhook counterpart of ``updater.start_polling()``. The
+    returned server must be stopped by the caller before the dispatcher, so
+    that no update arrives after the queue has been drained.
+    """
+    server = WebhookServer(updater.dispatcher, secret_token=secret_token, **server_kwargs)
+    ready = threading.Event()
+    threading.Thread(target=updater.dispatcher.start, kwargs={'ready': ready}, name='dispatcher',
+                     daemon=True).start()
+    ready.wait()
+    updater.job_queue.start()
+    updater.running = True
+    server.start()
+    updater.bot.set_webhook(url=url.rstrip('/') + server.path, secret_token=secret_token)
+    return server
@@ -0,0 +1,80 @@
+"""Coalescing of join bursts into a single welcome per chat."""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JoinBatch:
+    """Members who joined a chat within one coalescing window."""
+
+    def __init__(self, chat_id, reply_to_message_id):
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.members = []
+        self.member_ids = set()
+
+    def add(self, members):
+        """Add members, skipping anyone already in the batch so they are greeted once."""
+        for member in members:
+            if member.id not in self.member_ids:
+                self.member_ids.add(member.id)
+                self.members.append(member)
+
+
+class JoinCoalescer:
+    """Collect joins per chat and greet each burst once.
+
+    The first join in a chat opens a window of ``window`` seconds on the job
+    queue; joins arriving inside it are added to the same batch, and
+    ``greet(bot, batch)`` is called once when the window closes. A window of
+    0 greets every join message immediately.
+    """
+
+    def __init__(self, greet, window=3.0):
+        self.greet = greet
+        self.window = window
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def add(self, chat_id, members, message_id, context):
+        """Queue ``members`` who joined ``chat_id`` via message ``message_id``."""
+        with self._lock:
+            batch = self._batches.get(chat_id)
+            opened = batch is None
+            if opened:
+                batch = self._batches[chat_id] = JoinBatch(chat_id, message_id)
+            batch.add(members)
+
+        if not opened:
+            return
+        if self.window <= 0 or context.job_queue is None:
+            self._flush(context.bot, chat_id)
+        else:
+            context.job_queue.run_once(self._on_window_closed, self.window,
+                                       context=chat_id, name=f"welcome:{chat_id}")
+
+    def pending(self):
+        """Number of members waiting to be greeted across all chats."""
+        with self._lock:
+            return sum(len(batch.members) for batch in self._batches.values())
+
+    def flush_all(self, bot):
+        """Greet every pending batch now instead of at the end of its window, e.g. at shutdown."""
+        with self._lock:
+            chat_ids = list(self._batches)
+        for chat_id in chat_ids:
+            self._flush(bot, chat_id)
+
+    def _on_window_closed(self, context):
+        self._flush(context.bot, context.job.context)
+
+    def _flush(self, bot, chat_id):
+        with self._lock:
+            batch = self._batches.pop(chat_id, None)
+        if batch is None or not batch.members:
+            return
+        try:
+            self.greet(bot, batch)
+        except Exception as e:
+            logger.error(f"Error welcoming {len(batch.members)} members in chat {chat_id}: {e}")